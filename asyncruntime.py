@@ -0,0 +1,205 @@
+#! /usr/bin/python3
+
+"""
+Optional asyncio runtime.
+The mpd idle loop, the pinger, the info loop, the weather fetches and the
+display renderer run as tasks on one event loop instead of on their own
+threads. Delayed calls (marquee scrolling, backlight, snooze) are loop timers.
+The IR key handlers still run on the EventDispatcher's thread: they wait on
+the mpd connections and the display lock, which the loop must not do.
+Tasks and renders run to completion between awaits: code on the loop must
+never block on a lock held across an await.
+"""
+
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger('asyncruntime')
+
+LOCK_POLL = 0.1 # seconds between tries of a busy display lock
+
+class LoopCall:
+    """A delayed call made from another thread, cancellable before and after
+    it reaches the loop.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.handle = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle:
+            self.handle.cancel()
+
+class LoopScheduler:
+    """The scheduler.Scheduler interface on an asyncio loop."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.calls = 0          # callbacks run
+        self.late_total = 0.0   # seconds callbacks ran after their due time
+        self.late_max = 0.0
+        self.run_max = 0.0      # longest callback, seconds
+        self._pending = set()
+
+    def _call(self, call, when, function, args):
+        self._pending.discard(call)
+        if call.cancelled:
+            return
+        started = time.monotonic()
+        late = started - when
+        try:
+            function(*args)
+        except Exception:
+            logger.exception('scheduled call '+str(function)+' failed')
+        self.calls += 1
+        self.late_total += late
+        self.late_max = max(self.late_max, late)
+        self.run_max = max(self.run_max, time.monotonic() - started)
+
+    def _schedule(self, call, when, function, args):
+        if not call.cancelled:
+            call.handle = self.loop.call_later(max(0.0, when - time.monotonic()),
+                                               self._call, call, when,
+                                               function, args)
+
+    def call_later(self, delay, function, *args):
+        call = LoopCall()
+        when = time.monotonic() + delay
+        self._pending.add(call)
+        if in_loop_thread(self.loop):
+            self._schedule(call, when, function, args)
+        else:
+            self.loop.call_soon_threadsafe(self._schedule, call, when,
+                                           function, args)
+        return call
+
+    def pending(self):
+        return sum(1 for call in list(self._pending) if not call.cancelled)
+
+    def stats(self):
+        return {'calls': self.calls,
+                'pending': self.pending(),
+                'late_mean': self.late_total / self.calls if self.calls else 0.0,
+                'late_max': self.late_max,
+                'run_max': self.run_max,
+                }
+
+class AsyncDisplayQueue:
+    """The displayqueue.DisplayQueue interface as a loop task. Only the
+    newest request is drawn, at most once every min_interval seconds, once
+    the display lock is free. Renders fetch from mpd and take the display
+    lock, so they run on an executor thread, never on the loop.
+    """
+    def __init__(self, loop, lock, min_interval):
+        self.loop = loop
+        self.lock = lock
+        self.min_interval = min_interval
+        self._intent = None  # (render, args) of the newest request
+        self._wakeup = asyncio.Event()
+        self.last_frame = 0.0
+        self.posted = 0      # requests posted
+        self.rendered = 0    # requests drawn
+
+    def post(self, render, *args):
+        if not in_loop_thread(self.loop):
+            self.loop.call_soon_threadsafe(self.post, render, *args)
+            return
+        self._intent = (render, args) # latest wins
+        self.posted += 1
+        self._wakeup.set()
+
+    def pending(self):
+        return self._intent is not None
+
+    def stop(self):
+        self._intent = None
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            wait = self.last_frame + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait) # newer requests may arrive meanwhile
+            while self._intent is not None and not self.lock.acquire(False):
+                await asyncio.sleep(LOCK_POLL)
+            if self._intent is None:
+                continue
+            self.lock.release() # free now, the render takes it again
+            (render, args) = self._intent
+            self._intent = None
+            try:
+                await self.loop.run_in_executor(None, render, *args)
+            except Exception:
+                logger.exception('display request '+str(render)+' failed')
+            self.last_frame = time.monotonic()
+            self.rendered += 1
+
+def in_loop_thread(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError: # called from a thread without a running loop
+        return False
+
+async def wait_readable(loop, fileno):
+    """Returns once fileno has data to read."""
+    ready = loop.create_future()
+    loop.add_reader(fileno, lambda: ready.done() or ready.set_result(True))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fileno)
+
+class AsyncRuntime:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.scheduler = LoopScheduler(self.loop)
+        self.tasks = {}   # name -> coroutine function, started by run()
+        self._running = []
+        self._stopped = None
+
+    def add_task(self, name, coroutine_function, *args):
+        self.tasks[name] = (coroutine_function, args)
+        return self
+
+    def add_periodic(self, name, function, interval):
+        """Runs function now and then every interval seconds. interval may be
+        a callable, read again before every wait.
+        """
+        async def periodic():
+            while True:
+                try:
+                    function()
+                except Exception:
+                    logger.exception(name+' failed')
+                await asyncio.sleep(interval() if callable(interval) else interval)
+        return self.add_task(name, periodic)
+
+    def stop(self):
+        if self._stopped is None:
+            return
+        if in_loop_thread(self.loop):
+            self._stopped.set()
+        else:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _main(self):
+        self._stopped = asyncio.Event()
+        for (name, (coroutine_function, args)) in self.tasks.items():
+            logger.debug('starting task '+name)
+            self._running.append(self.loop.create_task(coroutine_function(*args)))
+        await self._stopped.wait()
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running = []
+        logger.debug('all tasks stopped')
+
+    def run(self):
+        """Runs the loop on the calling thread until stop()."""
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
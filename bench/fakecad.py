@@ -0,0 +1,158 @@
+#! /usr/bin/python3
+
+"""
+A stand-in pifacecad for the benchmarks.
+install() puts fake pifacecad and pifacecommon modules in sys.modules, so
+mpdremote runs without a PiFace Control and Display. The LCD keeps the
+2x40 display RAM so a benchmark can read the screen, and counts the bytes
+each call would send over SPI. The IR listener runs the registered handlers
+when a benchmark calls press().
+"""
+
+import sys
+import time
+import types
+import threading
+
+LCD_WIDTH = 16
+LCD_MAX_LINES = 2
+LCD_RAM_WIDTH = 80
+
+LISTENERS = [] # every IREventListener made, newest last
+
+class LCDBitmap(bytearray):
+    pass
+
+class FakeLCD:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ram = [[' '] * (LCD_RAM_WIDTH // LCD_MAX_LINES)
+                    for row in range(LCD_MAX_LINES)]
+        self.col = 0
+        self.row = 0
+        self.backlight = False
+        self.bitmaps = {}
+        self.spi_writes = 0   # command and data bytes sent to the lcd
+        self.calls = 0        # lcd method calls
+        self.last_write = 0.0 # time.monotonic() of the latest call
+
+    def _send(self, count):
+        with self._lock:
+            self.spi_writes += count
+            self.calls += 1
+            self.last_write = time.monotonic()
+
+    def screen(self):
+        return [''.join(c if type(c) is str else '#' for c in row[0:LCD_WIDTH])
+                for row in self.ram]
+
+    # the pifacecad.lcd.PiFaceLCD calls mpdremote makes ------------------
+    def clear(self):
+        for row in self.ram:
+            row[:] = [' '] * len(row)
+        (self.col, self.row) = (0, 0)
+        self._send(1)
+
+    def home(self):
+        (self.col, self.row) = (0, 0)
+        self._send(1)
+
+    def set_cursor(self, col, row):
+        (self.col, self.row) = (col, row)
+        self._send(1)
+
+    def write(self, text):
+        for char in text:
+            if char == '\n':
+                (self.col, self.row) = (0, (self.row + 1) % LCD_MAX_LINES)
+                continue
+            if self.col < len(self.ram[self.row]):
+                self.ram[self.row][self.col] = char
+            self.col += 1
+        self._send(len(text))
+
+    def write_custom_bitmap(self, index):
+        if self.col < len(self.ram[self.row]):
+            self.ram[self.row][self.col] = index
+        self.col += 1
+        self._send(1)
+
+    def store_custom_bitmap(self, index, bitmap):
+        self.bitmaps[index] = bytes(bitmap)
+        self._send(1 + len(bitmap))
+
+    def move_left(self):
+        self._send(1)
+
+    def move_right(self):
+        self._send(1)
+
+    def backlight_on(self):
+        self.backlight = True
+        self._send(1)
+
+    def backlight_off(self):
+        self.backlight = False
+        self._send(1)
+
+    def blink_off(self):
+        self._send(1)
+
+    def cursor_off(self):
+        self._send(1)
+
+    def display_on(self):
+        self._send(1)
+
+class PiFaceCAD:
+    lcd = None # one lcd shared by every PiFaceCAD, as on the real board
+
+    def __init__(self, *args, **kwargs):
+        if PiFaceCAD.lcd is None:
+            PiFaceCAD.lcd = FakeLCD()
+        self.lcd = PiFaceCAD.lcd
+
+class IREvent:
+    def __init__(self, ir_code):
+        self.ir_code = ir_code
+
+class IREventListener:
+    def __init__(self, prog=None, lircrc=None):
+        self.prog = prog
+        self.handlers = {}
+        self.activated = threading.Event()
+        LISTENERS.append(self)
+
+    def register(self, ir_code, callback):
+        self.handlers[ir_code] = callback
+
+    def activate(self):
+        self.activated.set()
+
+    def deactivate(self):
+        self.activated.clear()
+
+    def press(self, ir_code):
+        """Runs the handler of ir_code on the calling thread, as the
+        listener thread would. Returns False if no handler is registered.
+        """
+        handler = self.handlers.get(ir_code)
+        if handler is None:
+            return False
+        handler(IREvent(ir_code))
+        return True
+
+def install():
+    cad = types.ModuleType('pifacecad')
+    cad.PiFaceCAD = PiFaceCAD
+    cad.LCDBitmap = LCDBitmap
+    cad.IREvent = IREvent
+    cad.IREventListener = IREventListener
+    lcd = types.ModuleType('pifacecad.lcd')
+    lcd.LCD_WIDTH = LCD_WIDTH
+    lcd.LCD_MAX_LINES = LCD_MAX_LINES
+    lcd.LCD_RAM_WIDTH = LCD_RAM_WIDTH
+    cad.lcd = lcd
+    sys.modules['pifacecad'] = cad
+    sys.modules['pifacecad.lcd'] = lcd
+    sys.modules.setdefault('pifacecommon', types.ModuleType('pifacecommon'))
@@ -0,0 +1,504 @@
+#! /usr/bin/python3
+
+"""
+A stand-in mpd server for the benchmarks.
+Speaks enough of the mpd protocol for mpdremote: status, stats, the play queue,
+the database, stored playlists, command lists and idle. The library, the
+play queue and the stored playlists are generated at the requested sizes,
+and every reply can be delayed to model a slow server or network.
+Round trips are counted per command, so a benchmark can see what each key
+press costs.
+"""
+
+import time
+import socket
+import logging
+import threading
+from collections import Counter
+from select import select
+
+logger = logging.getLogger('fakempd')
+
+TRACKS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 5
+IDLE_POLL = 0.02 # seconds between checks for idle events
+
+class Ack(Exception):
+    def __init__(self, code, message):
+        super(Ack, self).__init__(message)
+        self.code = code
+
+def tokenize(line):
+    tokens = []
+    i = 0
+    while i < len(line):
+        if line[i] == ' ':
+            i += 1
+        elif line[i] == '"':
+            i += 1
+            token = []
+            while i < len(line) and line[i] != '"':
+                if line[i] == '\\':
+                    i += 1
+                token.append(line[i])
+                i += 1
+            tokens.append(''.join(token))
+            i += 1
+        else:
+            end = line.find(' ', i)
+            end = len(line) if end < 0 else end
+            tokens.append(line[i:end])
+            i = end
+    return tokens
+
+def window(items, arg):
+    if arg is None:
+        return items
+    if ':' in arg:
+        (start, end) = arg.split(':')
+        return items[int(start):int(end) if end else len(items)]
+    return items[int(arg):int(arg)+1]
+
+class Library:
+    def __init__(self, songs):
+        self.artists = max(1, songs // (TRACKS_PER_ALBUM * ALBUMS_PER_ARTIST))
+        self.files = {}
+        self.dirs = {'': []}
+        for a in range(self.artists):
+            artist = 'Artist %04d' % a
+            self.dirs[''].append(artist)
+            self.dirs[artist] = []
+            for b in range(ALBUMS_PER_ARTIST):
+                album = artist+'/Album %d' % b
+                self.dirs[artist].append(album)
+                self.dirs[album] = []
+                for t in range(TRACKS_PER_ALBUM):
+                    uri = album+'/%02d Track.flac' % t
+                    self.dirs[album].append(uri)
+                    self.files[uri] = {'file': uri,
+                                       'Title': 'Song %d of %s' % (t, album),
+                                       'Artist': artist,
+                                       'Album': 'Album %d' % b,
+                                       'Track': str(t),
+                                       'Time': '200',
+                                       'duration': '200.000'}
+
+    def songs(self, uri):
+        if uri in self.files:
+            return [self.files[uri]]
+        songs = []
+        for entry in self.dirs.get(uri, []):
+            songs.extend(self.songs(entry))
+        return songs
+
+class FakeMPD:
+    def __init__(self, queue=500, library=5000, playlists=5, playlist_size=300,
+                 latency=0.0, version='0.24.0', port=0):
+        self.latency = latency
+        self.version = version
+        self.library = Library(library)
+        allfiles = sorted(self.library.files)
+        self.playlists = {}
+        for p in range(playlists):
+            self.playlists['Playlist %d' % p] = [
+                allfiles[(p * 37 + i * 7) % len(allfiles)]
+                for i in range(playlist_size)]
+        self._lock = threading.Lock()
+        self.queue = []        # song dicts with Id
+        self.posversion = []   # playlist version a position last changed in
+        self.playlist_version = 1
+        self.db_update = 1600000000 # stats db_update, a unix time
+        self.next_id = 1
+        self.state = {'volume': 50, 'repeat': '0', 'random': '0',
+                      'single': '0', 'consume': '0', 'state': 'play',
+                      'song': 0, 'elapsed': 0}
+        for uri in allfiles[:queue]:
+            self._add(uri)
+        self.state['song'] = 0 if self.queue else None
+        self.round_trips = 0
+        self.commands = Counter()
+        self.last_command = 0.0 # time.monotonic() of the latest reply
+        self.connections = 0
+        self.clients = []
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', port))
+        self.port = self.sock.getsockname()[1]
+
+    def start(self):
+        self.sock.listen(16)
+        thread = threading.Thread(target=self._accept, name='fakempd')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.sock.close()
+
+    def counts(self):
+        with self._lock:
+            return self.round_trips, Counter(self.commands)
+
+    def _accept(self):
+        while True:
+            try:
+                (client, address) = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            connection = Connection(self, client)
+            thread = threading.Thread(target=connection.serve,
+                                      name='fakempd-%d' % self.connections)
+            thread.daemon = True
+            thread.start()
+
+    def notify(self, subsystem):
+##      Assumes _lock is acquired before calling
+        for client in self.clients:
+            client.events.add(subsystem)
+
+    # play queue -------------------------------------------------------------
+    def _add(self, uri, pos=None):
+        song = dict(self.library.files[uri])
+        song['Id'] = str(self.next_id)
+        self.next_id += 1
+        pos = len(self.queue) if pos is None else pos
+        self.queue.insert(pos, song)
+        self.posversion.insert(pos, 0)
+        self._changed(pos)
+        return song['Id']
+
+    def _changed(self, pos):
+        self.playlist_version += 1
+        for p in range(pos, len(self.queue)):
+            self.posversion[p] = self.playlist_version
+
+    def _queue_entry(self, pos):
+        song = dict(self.queue[pos])
+        song['Pos'] = str(pos)
+        return song
+
+    def _delete(self, pos):
+        if pos < 0 or pos >= len(self.queue):
+            raise Ack(2, 'Bad song index')
+        del self.queue[pos]
+        del self.posversion[pos]
+        self._changed(pos)
+        song = self.state['song']
+        if song is not None and pos <= song:
+            self.state['song'] = max(0, song - 1) if self.queue else None
+
+    # command dispatch -------------------------------------------------------
+    def execute(self, command, args):
+##      Assumes _lock is acquired before calling. Returns (key, value) pairs
+        state = self.state
+        if command == 'ping' or command == 'close':
+            return []
+        if command == 'status':
+            items = [('volume', state['volume']), ('repeat', state['repeat']),
+                     ('random', state['random']), ('single', state['single']),
+                     ('consume', state['consume']),
+                     ('playlist', self.playlist_version),
+                     ('playlistlength', len(self.queue)),
+                     ('state', state['state'])]
+            if state['song'] is not None and self.queue:
+                song = state['song']
+                items.extend([('song', song),
+                              ('songid', self.queue[song]['Id']),
+                              ('time', '%d:200' % state['elapsed']),
+                              ('elapsed', '%d.000' % state['elapsed']),
+                              ('duration', '200.000')])
+                if song + 1 < len(self.queue):
+                    items.extend([('nextsong', song + 1),
+                                  ('nextsongid', self.queue[song + 1]['Id'])])
+            return items
+        if command == 'currentsong':
+            if state['song'] is None or not self.queue:
+                return []
+            return list(self._queue_entry(state['song']).items())
+        if command == 'playlistinfo':
+            positions = window(list(range(len(self.queue))),
+                               args[0] if args else None)
+            items = []
+            for pos in positions:
+                items.extend(self._queue_entry(pos).items())
+            return items
+        if command == 'plchanges':
+            since = int(args[0])
+            items = []
+            for pos in range(len(self.queue)):
+                if self.posversion[pos] > since:
+                    items.extend(self._queue_entry(pos).items())
+            return items
+        if command == 'plchangesposid':
+            since = int(args[0])
+            items = []
+            for pos in range(len(self.queue)):
+                if self.posversion[pos] > since:
+                    items.extend([('cpos', pos), ('Id', self.queue[pos]['Id'])])
+            return items
+        if command == 'lsinfo':
+            uri = args[0] if args else ''
+            if uri in self.library.files:
+                return list(self.library.files[uri].items())
+            if uri not in self.library.dirs:
+                raise Ack(50, 'No such directory')
+            items = []
+            for entry in self.library.dirs[uri]:
+                if entry in self.library.files:
+                    items.extend(self.library.files[entry].items())
+                else:
+                    items.extend([('directory', entry),
+                                  ('Last-Modified', '2020-01-01T00:00:00Z')])
+            if uri == '':
+                for name in sorted(self.playlists):
+                    items.extend([('playlist', name),
+                                  ('Last-Modified', '2020-01-01T00:00:00Z')])
+            return items
+        if command == 'listplaylists':
+            items = []
+            for name in sorted(self.playlists):
+                items.extend([('playlist', name),
+                              ('Last-Modified', '2020-01-01T00:00:00Z')])
+            return items
+        if command in ('listplaylistinfo', 'listplaylist', 'playlistlength',
+                       'load'):
+            if not args or args[0] not in self.playlists:
+                raise Ack(50, 'No such playlist')
+            uris = self.playlists[args[0]]
+            if command == 'playlistlength':
+                return [('songs', len(uris)), ('playtime', 200 * len(uris))]
+            if command == 'load':
+                for uri in uris:
+                    self._add(uri)
+                self.notify('playlist')
+                return []
+            uris = window(uris, args[1] if len(args) > 1 else None)
+            items = []
+            for uri in uris:
+                items.extend(self.library.files[uri].items()
+                             if command == 'listplaylistinfo'
+                             else [('file', uri)])
+            return items
+        if command in ('add', 'addid'):
+            songs = self.library.songs(args[0])
+            if not songs:
+                raise Ack(50, 'No such directory')
+            pos = int(args[1]) if len(args) > 1 else None
+            ids = [self._add(song['file'], pos) for song in songs]
+            self.notify('playlist')
+            return [('Id', ids[0])] if command == 'addid' else []
+        if command == 'clear':
+            self.queue = []
+            self.posversion = []
+            self.playlist_version += 1
+            state['song'] = None
+            self.notify('playlist')
+            return []
+        if command in ('delete', 'deleteid'):
+            if command == 'deleteid':
+                pos = next((p for (p, s) in enumerate(self.queue)
+                            if s['Id'] == args[0]), -1)
+            else:
+                pos = int(args[0])
+            self._delete(pos)
+            self.notify('playlist')
+            return []
+        if command in ('play', 'playid'):
+            if args:
+                if command == 'playid':
+                    pos = next((p for (p, s) in enumerate(self.queue)
+                                if s['Id'] == args[0]), -1)
+                else:
+                    pos = int(args[0])
+                if pos < 0 or pos >= len(self.queue):
+                    raise Ack(2, 'Bad song index')
+                state['song'] = pos
+                state['elapsed'] = 0
+            state['state'] = 'play'
+            self.notify('player')
+            return []
+        if command in ('pause', 'stop'):
+            state['state'] = 'pause' if command == 'pause' else 'stop'
+            self.notify('player')
+            return []
+        if command in ('next', 'previous'):
+            if state['song'] is not None and self.queue:
+                step = 1 if command == 'next' else -1
+                state['song'] = max(0, min(len(self.queue) - 1,
+                                           state['song'] + step))
+                state['elapsed'] = 0
+            self.notify('player')
+            return []
+        if command in ('seek', 'seekcur'):
+            state['elapsed'] = max(0, int(float(args[-1])))
+            self.notify('player')
+            return []
+        if command == 'setvol':
+            state['volume'] = max(0, min(100, int(args[0])))
+            self.notify('mixer')
+            return []
+        if command in ('repeat', 'random', 'single', 'consume'):
+            state[command] = args[0]
+            self.notify('options')
+            return []
+        if command == 'stats':
+            return [('artists', self.library.artists),
+                    ('albums', self.library.artists * ALBUMS_PER_ARTIST),
+                    ('songs', len(self.library.files)),
+                    ('db_update', self.db_update)]
+        if command == 'listallinfo':
+            items = []
+            for song in self.library.songs(args[0] if args else ''):
+                items.extend(song.items())
+            return items
+        if command == 'list':
+            tag = {'artist': 'Artist', 'album': 'Album',
+                   'title': 'Title'}.get(args[0].lower(), args[0])
+            values = sorted(set(song.get(tag, '') for song in self.find(args[1:])))
+            return [(args[0].capitalize(), value) for value in values]
+        if command == 'find':
+            arg = None
+            if 'window' in args:
+                arg = args[args.index('window') + 1]
+                args = args[:args.index('window')]
+            items = []
+            for song in window(self.find(args), arg):
+                items.extend(song.items())
+            return items
+        if command == 'findadd':
+            songs = self.find(args)
+            for song in songs:
+                self._add(song['file'])
+            if songs:
+                self.notify('playlist')
+            return []
+        raise Ack(5, 'unknown command "'+command+'"')
+
+    def find(self, args):
+##      exact matches of tag value pairs, 'file' matches the uri
+        pairs = list(zip(args[0::2], args[1::2]))
+        tags = {'artist': 'Artist', 'album': 'Album', 'title': 'Title',
+                'file': 'file'}
+        return [song for (uri, song) in sorted(self.library.files.items())
+                if all(song.get(tags.get(tag.lower(), tag)) == value
+                       for (tag, value) in pairs)]
+
+class Connection:
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.rfile = sock.makefile('r', encoding='utf-8', newline='\n')
+        self.events = set()
+
+    def send(self, text):
+        self.sock.sendall(text.encode('utf-8'))
+
+    def respond(self, items):
+        return ''.join(str(key)+': '+str(value)+'\n' for (key, value) in items)
+
+    def serve(self):
+        server = self.server
+        with server._lock:
+            server.clients.append(self)
+        try:
+            self.send('OK MPD '+server.version+'\n')
+            commandlist = None
+            for line in self.rfile:
+                tokens = tokenize(line.rstrip('\n'))
+                if not tokens:
+                    continue
+                (command, args) = (tokens[0], tokens[1:])
+                if command in ('command_list_begin', 'command_list_ok_begin'):
+                    commandlist = (command, [])
+                    continue
+                if commandlist is not None and command != 'command_list_end':
+                    commandlist[1].append((command, args))
+                    continue
+                if command == 'idle':
+                    if not self.idle():
+                        return
+                    continue
+                if command == 'noidle':
+                    continue # not idling, mpd ignores it
+                if server.latency:
+                    time.sleep(server.latency)
+                if command == 'command_list_end':
+                    (kind, commands) = commandlist
+                    commandlist = None
+                    self.send(self.run_list(kind, commands))
+                else:
+                    self.send(self.run(command, args))
+                if command == 'close':
+                    return
+        except (OSError, ValueError):
+            pass
+        finally:
+            with server._lock:
+                server.clients.remove(self)
+            self.sock.close()
+
+    def run(self, command, args, index=0):
+        server = self.server
+        with server._lock:
+            server.round_trips += 1
+            server.commands[command] += 1
+            server.last_command = time.monotonic()
+            try:
+                return self.respond(server.execute(command, args))+'OK\n'
+            except Ack as ack:
+                return ('ACK ['+str(ack.code)+'@'+str(index)+'] {'+command+'} '+
+                        str(ack)+'\n')
+
+    def run_list(self, kind, commands):
+        server = self.server
+        reply = []
+        with server._lock:
+            server.round_trips += 1
+            server.last_command = time.monotonic()
+            for (index, (command, args)) in enumerate(commands):
+                server.commands[command] += 1
+                try:
+                    reply.append(self.respond(server.execute(command, args)))
+                except Ack as ack:
+                    reply.append('ACK ['+str(ack.code)+'@'+str(index)+'] {'+
+                                 command+'} '+str(ack)+'\n')
+                    return ''.join(reply)
+                if kind == 'command_list_ok_begin':
+                    reply.append('list_OK\n')
+        reply.append('OK\n')
+        return ''.join(reply)
+
+    def idle(self):
+##      waits for an event or noidle. Returns False if the client went away.
+        with self.server._lock:
+            self.server.commands['idle'] += 1
+        while True:
+            with self.server._lock:
+                if self.events:
+                    events = sorted(self.events)
+                    self.events.clear()
+                    self.send(''.join('changed: '+e+'\n' for e in events)+'OK\n')
+                    return True
+            if select([self.sock], [], [], IDLE_POLL)[0]:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip() == 'noidle':
+                    self.send('OK\n')
+                    return True
+                return False # mpd closes on anything but noidle in idle
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='stand-in mpd server')
+    parser.add_argument('--port', type=int, default=6600)
+    parser.add_argument('--queue', type=int, default=500)
+    parser.add_argument('--library', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeMPD(args.queue, args.library, latency=args.latency,
+                     port=args.port).start()
+    print('fake mpd on port '+str(server.port))
+    while True:
+        time.sleep(60)
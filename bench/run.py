@@ -0,0 +1,293 @@
+#! /usr/bin/python3
+
+"""
+Benchmarks mpdremote against the stand-in mpd server and pifacecad.
+mpdremote.main() runs unmodified on its own thread; scripted IR key presses
+are fed to its listener one at a time. After each press the bench waits
+until the LCD and the server have been quiet for --settle seconds, then
+records the time to the last activity, the mpd round trips and the SPI
+writes the press caused. The report gives latency percentiles per key,
+round trips per action, SPI writes per frame, the startup phases, the
+thread counts and the counters mpdremote keeps.
+
+    python3 bench/run.py                     # threaded runtime, all scripts
+    python3 bench/run.py --asyncio --latency 0.005 --output bench_output.txt
+    python3 bench/run.py --script queue --burst  # held keys
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import itertools
+import tempfile
+import threading
+from collections import Counter, defaultdict
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+sys.path.insert(0, ROOT)
+
+import fakecad
+from fakempd import FakeMPD
+
+SCRIPTS = {
+    'transport': ['disp', 'volumeup', 'volumeup', 'volumedown', 'next',
+                  'prev', 'advance', 'replay', 'pause', 'play', 'disp'],
+    'queue': ['menu', 'right'] + ['down'] * 40 + ['up'] * 10 + ['left', 'left'],
+    'playlists': ['menu', 'down', 'right', 'down', 'right'] + ['down'] * 80 +
+                 ['left', 'left', 'left'],
+    'database': ['menu', 'down', 'down', 'right'] + ['down'] * 10 +
+                ['right'] + ['down'] * 3 + ['right'] + ['down'] * 5 +
+                ['left', 'left', 'up', 'right', 'left', 'return', 'left'],
+    'modes': ['menu', 'down', 'down', 'down', 'down', 'down', 'right',
+              'select', 'down', 'select', 'up', 'left', 'left'],
+    'jump': ['menu', 'right', 'right', '7key', '6key', '6key', '4key', '0key',
+             '5key', 'down', 'return', 'right', 'right', '2key', '5key',
+             'select'],
+    'tags': ['menu', 'down', 'down', 'down', 'right'] + ['down'] * 10 +
+            ['right', 'down', 'right'] + ['down'] * 4 +
+            ['left', 'left', 'up', 'right', 'select', 'return', 'left'],
+    'search': ['menu', 'down', 'down', 'down', 'down', 'right', '7key', '6key',
+               '6key', '4key', 'down', 'down', 'select', 'left', 'left',
+               'left', 'left', '2key', '7key', '8key', 'select', 'return',
+               'left'],
+}
+SCRIPTS['all'] = (SCRIPTS['transport'] + SCRIPTS['queue'] +
+                  SCRIPTS['jump'] + SCRIPTS['playlists'] +
+                  SCRIPTS['database'] + SCRIPTS['tags'] + SCRIPTS['search'] +
+                  SCRIPTS['modes'])
+
+MAX_SETTLE = 5.0 # seconds a press may keep the display or server busy
+
+def mpd2_compat():
+##  mpdremote is written for the python-mpd2 of its time. Newer releases
+##  dropped send_idle, fetch_idle and the synchronous noidle; put them back.
+    from mpd import MPDClient, CommandError
+    if hasattr(MPDClient, 'send_idle'):
+        return
+    def send_idle(self, *subsystems):
+        self._write_command('idle', subsystems)
+        self._bench_idling = True
+    def fetch_idle(self):
+        self._bench_idling = False
+        return list(self._parse_list(self._read_lines()))
+    def noidle(self):
+        if not getattr(self, '_bench_idling', False):
+            raise CommandError('cannot send noidle if send_idle was not called')
+        self._write_command('noidle')
+        return self.fetch_idle()
+    MPDClient.send_idle = send_idle
+    MPDClient.fetch_idle = fetch_idle
+    MPDClient.noidle = noidle
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def thread_names():
+##  mpdremote's threads, numbered names grouped
+    names = Counter()
+    for thread in threading.enumerate():
+        if thread.name.startswith('fakempd') or thread is threading.main_thread():
+            continue
+        names[re.sub(r'-?\d+', '', thread.name).strip() or thread.name] += 1
+    return names
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.presses = [] # (key, latency, round trips, spi writes, frames)
+        self.commands = Counter()
+        self.threads_max = 0
+
+    def setup(self):
+        args = self.args
+        self.server = FakeMPD(args.queue, args.library, args.playlists,
+                              args.playlist_size, args.latency,
+                              args.mpd_version).start()
+        home = tempfile.mkdtemp(prefix='mpdbench')
+        with open(os.path.join(home, '.mpdremoterc'), 'w') as fd:
+            fd.write('[staticpreferences]\n'
+                     'weather_stations = ()\n'
+                     'log_level = '+args.log_level+'\n')
+        with open(os.path.join(home, '.mpdremoteprefs'), 'w') as fd:
+            fd.write('[preferences]\n'
+                     '    preferredmpd = bench\n'
+                     '    display_info = Nothing\n'
+                     '    backlight_duration = -1.0\n')
+        os.environ['HOME'] = home
+        os.chdir(ROOT) # mpdremote reads ./mpdremoterc
+        fakecad.install()
+        mpd2_compat()
+        import mpdremote
+        self.app = mpdremote
+        port = str(self.server.port)
+        mpdremote.DISCOVERY.browse = lambda: [{'name': 'bench',
+                                               'host': '127.0.0.1',
+                                               'address': '127.0.0.1',
+                                               'port': port}]
+
+    def start(self):
+        sys.argv = ['mpdremote'] + (['--asyncio'] if self.args.asyncio else [])
+        started = time.monotonic()
+        self.main = threading.Thread(target=self.app.main, name='mpdremote')
+        self.main.daemon = True
+        self.main.start()
+        while not fakecad.LISTENERS or not fakecad.LISTENERS[-1].activated.is_set():
+            if not self.main.is_alive():
+                raise RuntimeError('mpdremote.main() exited during startup')
+            time.sleep(0.001)
+        self.listener = fakecad.LISTENERS[-1]
+        self.lcd = fakecad.PiFaceCAD.lcd
+        self.startup = time.monotonic() - started
+        self.settle(started)
+        self.first_screen = self.lcd.screen()
+
+    def activity(self):
+        return max(self.lcd.last_write, self.server.last_command)
+
+    def settle(self, since):
+##      waits for the lcd and the server to go quiet, returns the last activity
+        while True:
+            now = time.monotonic()
+            last = max(self.activity(), since)
+            if now - last >= self.args.settle or now - since > MAX_SETTLE:
+                return last
+            time.sleep(0.005)
+
+    def press(self, key, times=1):
+        (trips, commands) = self.server.counts()
+        spi = self.lcd.spi_writes
+        frames = self.app.LM.frames
+        started = time.monotonic()
+        for press in range(times):
+            self.listener.press(key)
+        returned = time.monotonic()
+        last = self.settle(started)
+        latency = max(returned, last) - started
+        (trips2, commands2) = self.server.counts()
+        self.commands.update(commands2 - commands)
+        self.presses.append((key, latency, trips2 - trips,
+                             self.lcd.spi_writes - spi,
+                             self.app.LM.frames - frames))
+        self.threads_max = max(self.threads_max, sum(thread_names().values()))
+
+    def run(self):
+        keys = SCRIPTS[self.args.script] * self.args.repeat
+        if not self.args.burst:
+            for key in keys:
+                self.press(key)
+        else:
+            # a run of one key is pressed without waiting, as a held key
+            for (key, run) in itertools.groupby(keys):
+                self.press(key, len(list(run)))
+        self.threads_end = thread_names()
+
+    def stop(self):
+        self.listener.press('power')
+        self.main.join(10.0)
+        self.server.stop()
+
+    def report(self):
+        args = self.args
+        lines = []
+        out = lines.append
+        out('mpdremote benchmark: '+('asyncio' if args.asyncio else 'threaded')+
+            ' runtime, script '+args.script+' x'+str(args.repeat)+
+            (', bursts' if args.burst else '')+
+            ', queue '+str(args.queue)+', library '+str(args.library)+
+            ', playlist '+str(args.playlist_size)+
+            ', mpd '+args.mpd_version+
+            ', latency {:.1f} ms'.format(args.latency * 1000))
+        out('')
+        out('startup: {:.3f}s to listener'.format(self.startup)+'; '+
+            ', '.join(name+' {:.3f}s'.format(secs)
+                      for (name, secs) in self.app.STARTUP.phases))
+        out('first screen: '+' | '.join(self.first_screen))
+        out('')
+        latencies = [p[1] * 1000 for p in self.presses]
+        out('key presses: '+str(len(self.presses))+
+            '  latency ms p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+                percentile(latencies, 50), percentile(latencies, 90),
+                percentile(latencies, 99), max(latencies or [0.0])))
+        out('(latency: press to the last lcd write or mpd reply it caused)')
+        out('')
+        out('{:<12}{:>6}{:>9}{:>9}{:>12}{:>11}{:>12}'.format(
+            'key', 'n', 'p50 ms', 'max ms', 'trips/key', 'spi/key', 'spi/frame'))
+        bykey = defaultdict(list)
+        for press in self.presses:
+            bykey[press[0]].append(press)
+        for (key, presses) in sorted(bykey.items()):
+            lat = [p[1] * 1000 for p in presses]
+            frames = sum(p[4] for p in presses)
+            spi = sum(p[3] for p in presses)
+            out('{:<12}{:>6}{:>9.1f}{:>9.1f}{:>12.2f}{:>11.1f}{:>12}'.format(
+                key, len(presses), percentile(lat, 50), max(lat),
+                sum(p[2] for p in presses) / len(presses), spi / len(presses),
+                '{:.1f}'.format(spi / frames) if frames else '-'))
+        out('')
+        trips = sum(p[2] for p in self.presses)
+        frames = sum(p[4] for p in self.presses)
+        spi = sum(p[3] for p in self.presses)
+        out('mpd round trips: '+str(trips)+' total, {:.2f} per key'.format(
+            trips / max(len(self.presses), 1)))
+        out('  '+', '.join(command+' '+str(count)
+                           for (command, count) in self.commands.most_common(12)))
+        out('lcd: '+str(spi)+' spi writes, '+str(frames)+' frames, '+
+            ('{:.1f}'.format(spi / frames) if frames else '-')+' spi writes per frame')
+        out('counters:')
+        for (part, counters) in self.app.stats().items():
+            out('  '+part+': '+', '.join(
+                name+' '+('{:.3f}'.format(value) if type(value) is float
+                          else str(value))
+                for (name, value) in counters.items()))
+        out('threads: '+str(self.threads_max)+' max during the script; at the end: '+
+            ', '.join(name+' '+str(count)
+                      for (name, count) in sorted(self.threads_end.items())))
+        return '\n'.join(lines)+'\n'
+
+def main():
+    parser = argparse.ArgumentParser(description='mpdremote benchmark')
+    parser.add_argument('--script', default='all', choices=sorted(SCRIPTS))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='times the script is run')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='run mpdremote with its asyncio runtime')
+    parser.add_argument('--burst', action='store_true',
+                        help='press runs of one key without settling in between')
+    parser.add_argument('--queue', type=int, default=500,
+                        help='songs in the play queue')
+    parser.add_argument('--library', type=int, default=5000,
+                        help='songs in the database')
+    parser.add_argument('--playlists', type=int, default=5,
+                        help='stored playlists')
+    parser.add_argument('--playlist-size', type=int, default=300,
+                        help='songs in each stored playlist')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds added to every mpd reply')
+    parser.add_argument('--mpd-version', default='0.24.0',
+                        help='version the server announces')
+    parser.add_argument('--settle', type=float, default=0.4,
+                        help='quiet seconds that end a key press')
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+    bench = Bench(args)
+    bench.setup()
+    bench.start()
+    bench.run()
+    bench.stop()
+    report = bench.report()
+    sys.stdout.write(report)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(report)
+
+if __name__ == '__main__':
+    main()
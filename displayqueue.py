@@ -0,0 +1,73 @@
+#! /usr/bin/python3
+
+"""
+Coalesces display updates.
+Producers post what should be shown; one renderer thread draws only the
+newest request, at most once every min_interval seconds. A burst of mpd idle
+events then costs one redraw instead of one per event.
+"""
+
+import time
+import logging
+from threading import Condition, Thread
+
+logger = logging.getLogger('display')
+
+MIN_INTERVAL = 0.25 # seconds between frames
+
+class DisplayQueue:
+    def __init__(self, min_interval=MIN_INTERVAL, name='display'):
+        self.min_interval = min_interval
+        self.name = name
+        self._cond = Condition()
+        self._intent = None  # (render, args) of the newest request
+        self._thread = None
+        self._stop = False
+        self.last_frame = 0.0
+        self.posted = 0      # requests posted
+        self.rendered = 0    # requests drawn
+
+    def post(self, render, *args):
+        with self._cond:
+            if self._intent is not None:
+                logger.debug('display request replaced')
+            self._intent = (render, args) # latest wins
+            self.posted += 1
+            if self._thread is None:
+                self._stop = False
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self):
+        """True while a request is waiting to be drawn."""
+        with self._cond:
+            return self._intent is not None
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._intent = None
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._intent is None and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    self._thread = None
+                    return
+                wait = self.last_frame + self.min_interval - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait) # newer requests may arrive meanwhile
+                    continue
+                (render, args) = self._intent
+                self._intent = None
+            try:
+                render(*args)
+            except Exception:
+                logger.exception('display request '+str(render)+' failed')
+            self.last_frame = time.monotonic()
+            self.rendered += 1
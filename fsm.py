@@ -41,14 +41,27 @@ class Fsm: # Finite State Machine
         self.current_state = None
         self.state_table = {}
         
-    def execute(self, event):
-        if self.current_state.handles(event):
-            tostate = self.current_state.handle_event(event)
+    def execute(self, event, count=1, render=True):
+        """Runs event count times. Moves within a state run their actions
+        count times and the enter handlers once; with render False the
+        enter handlers of such a move are skipped, as their output is
+        stale before it is shown.
+        """
+        while count > 0:
+            if not self.current_state.handles(event):
+                logger.debug(event + ' not an event for state: ' + self.current_state.name)
+                return
             fromstate = self.current_state.name
+            if self.current_state.eventhandler(event)[0] == fromstate:
+                for step in range(count):
+                    self.current_state.handle_event(event)
+                if render:
+                    self.current_state.handle_enter(fromstate)
+                return
+            tostate = self.current_state.handle_event(event)
             self.current_state = self.state_table[tostate]
             self.current_state.handle_enter(fromstate)
-        else:
-            logger.debug(event + ' not an event for state: ' + self.current_state.name)
+            count -= 1
 
     def add_state(self, state):
         self.state_table[state.name] = state
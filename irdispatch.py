@@ -0,0 +1,174 @@
+#! /usr/bin/python3
+
+"""
+Dispatches IR remote events.
+The listener thread only queues events; a dispatcher runs the handlers in
+the order the keys were pressed. Repeats of a navigation key that queue up
+while a handler is busy are collapsed into a single call with a step count,
+so a held key costs one round trip per batch instead of one per press.
+The dispatcher also counts how long a key has been held, for handlers that
+speed up, and turns two keys pressed in quick succession into one chord
+event. Keys that should not wait for each other are given dispatchers of
+their own, each a lane with its own order, collapsing and hold count.
+"""
+
+import time
+import logging
+from collections import deque
+from threading import Condition, Thread
+
+logger = logging.getLogger('irdispatch')
+
+COLLAPSE = ('up', 'down', 'left', 'volumeup', 'volumedown', 'advance', 'replay')
+HOLD_GAP = 0.25     # seconds between the repeats of a held key
+ACCELERATION = ((20, 25), (10, 5), (0, 1)) # (presses held beyond, step)
+CHORD_WINDOW = 0.4  # seconds for the second key of a chord
+
+class ChordEvent:
+    def __init__(self, ir_code):
+        self.ir_code = ir_code
+
+class EventDispatcher:
+    def __init__(self, collapse=COLLAPSE, name='irdispatch'):
+        self.collapse = set(collapse)
+        self.name = name
+        self.handlers = {}  # ir_code -> (handler, takes a step count)
+        self.chords = {}    # first ir_code -> {second ir_code: (name, when)}
+        self._cond = Condition()
+        self._queue = deque() # (event, time.monotonic() when posted)
+        self.held = 0       # presses of the key being held, this batch included
+        self._stepped = 0   # presses of the held key step() has been called for
+        self._held_code = None
+        self._held_at = 0.0
+        self._thread = None
+        self._stop = False
+        self.received = 0   # events queued
+        self.dispatched = 0 # handler calls
+
+    def register(self, ir_code, handler, steps=False):
+        """handler(event) runs once per event; with steps,
+        handler(event, count) runs once per batch of repeats.
+        """
+        self.handlers[ir_code] = (handler, steps)
+
+    def chord(self, first, second, name, when=None):
+        """first then second within CHORD_WINDOW dispatch a ChordEvent
+        named name. first is held back for the window only while when()
+        is true, so it is not delayed where the chord means nothing.
+        """
+        self.chords.setdefault(first, {})[second] = (name, when)
+
+    def step(self):
+        """Step size for the next press of the key being held: larger the
+        longer it is held. A batch of repeats runs its action once per
+        press, each call takes the step of its own press.
+        """
+        self._stepped = min(self._stepped + 1, self.held)
+        for (held, step) in ACCELERATION:
+            if self._stepped > held:
+                return step
+        return 1
+
+    def post(self, event):
+        # the listener callback, returns at once
+        with self._cond:
+            if self._stop: # keys pressed after stop() are dropped
+                return
+            self._queue.append((event, time.monotonic()))
+            self.received += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self, accepts=None):
+        """Events still queued, only those whose ir_code accepts() if given."""
+        with self._cond:
+            if accepts is None:
+                return len(self._queue)
+            return sum(1 for (event, posted) in self._queue
+                       if accepts(event.ir_code))
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._queue.clear()
+            self._cond.notify()
+
+    def _chord(self, now):
+##      Assumes _cond is acquired before calling. Returns the chord event,
+##      the seconds to wait for its second key, or None if there is none.
+        (event, posted) = self._queue[0]
+        chords = self.chords.get(event.ir_code)
+        if not chords or not any(when is None or when()
+                                 for (name, when) in chords.values()):
+            return None
+        if len(self._queue) == 1:
+            waited = now - posted
+            return CHORD_WINDOW - waited if waited < CHORD_WINDOW else None
+        (second, at) = self._queue[1]
+        if second.ir_code not in chords or at - posted > CHORD_WINDOW:
+            return None
+        (name, when) = chords[second.ir_code]
+        if when is not None and not when():
+            return None
+        self._queue.popleft()
+        self._queue.popleft()
+        logger.debug(event.ir_code+' '+second.ir_code+' chord: '+name)
+        return ChordEvent(name)
+
+    def _next(self):
+##      Assumes _cond is acquired before calling. Returns (event, count),
+##      or (None, seconds to wait) while a chord may still complete.
+        chord = self._chord(time.monotonic())
+        if isinstance(chord, ChordEvent):
+            self._held_code = None
+            return chord, 1
+        if chord is not None:
+            return None, chord
+        (event, posted) = self._queue.popleft()
+        (count, last) = (1, posted)
+        if event.ir_code in self.collapse:
+            while self._queue and self._queue[0][0].ir_code == event.ir_code:
+                (repeat, last) = self._queue.popleft()
+                count += 1
+        if count > 1:
+            logger.debug(event.ir_code+' x'+str(count)+' collapsed')
+        if event.ir_code == self._held_code and posted - self._held_at <= HOLD_GAP:
+            self.held += count
+        else:
+            self.held = count
+        self._stepped = self.held - count
+        self._held_code = event.ir_code
+        self._held_at = last
+        return event, count
+
+    def dispatch(self, event, count=1):
+        if event.ir_code not in self.handlers:
+            logger.debug('no handler for '+event.ir_code)
+            return
+        (handler, steps) = self.handlers[event.ir_code]
+        for call in ([count] if steps else range(count)):
+            try:
+                if steps:
+                    handler(event, count)
+                else:
+                    handler(event)
+            except Exception:
+                logger.exception(event.ir_code+' handler failed')
+            self.dispatched += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    self._thread = None
+                    return
+                (event, count) = self._next()
+                if event is None:
+                    self._cond.wait(count) # a chord may follow
+                    continue
+            self.dispatch(event, count)
@@ -0,0 +1,215 @@
+#! /usr/bin/python3
+
+"""
+A local index of the mpd library for searching from the remote.
+Artist, album and title are kept in an SQLite file together with their T9
+digits, the keys of a phone keypad, so a prefix typed on the IR number keys
+is a range lookup over an indexed column. The index is rebuilt in the
+background when the db_update time in mpd's stats differs from the one it
+was built from. The build streams listallinfo into new tables that
+replace the old ones in one transaction, so searches go on meanwhile and
+the library is never held in memory.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import namedtuple
+from mpd import (CommandError, ConnectionError)
+from socket import error as SocketError
+from socket import timeout as SocketTimeout
+from scheduler import Debouncer
+
+logger = logging.getLogger('libraryindex')
+
+INDEX_PATH = '~/.mpdremote.db'
+UPDATE_DELAY = 2.0  # seconds, database events within this time update once
+MAX_MATCHES = 50    # matches returned per kind
+# table: (columns, the name its results are shown and sorted by)
+TABLES = {'songs': ('(file TEXT, artist TEXT, album TEXT, title TEXT, t9 TEXT)',
+                    'title'),
+          'artists': ('(artist TEXT, t9 TEXT)', 'artist'),
+          'albums': ('(album TEXT, artist TEXT, t9 TEXT)', 'album')}
+
+KEYPAD = {'2': 'abc', '3': 'def', '4': 'ghi', '5': 'jkl', '6': 'mno',
+          '7': 'pqrs', '8': 'tuv', '9': 'wxyz'}
+DIGITS = {letter: digit for (digit, letters) in KEYPAD.items()
+          for letter in letters}
+
+def t9(text):
+##  digits as typed on a keypad: letters to their key, digits kept,
+##  spaces to 0, anything else to 1
+    digits = []
+    for char in unicodedata.normalize('NFKD', text.lower()):
+        if unicodedata.combining(char):
+            continue
+        if char in DIGITS:
+            digits.append(DIGITS[char])
+        elif char.isdigit():
+            digits.append(char if char in '0123456789' else '1')
+        elif char.isspace():
+            digits.append('0')
+        else:
+            digits.append('1')
+    return ''.join(digits)
+
+def _tag(song, tag):
+    value = song.get(tag, '')
+    return value[0] if type(value) is list else value # repeated tags
+
+# a search result: findadd query adds it to the play queue
+Match = namedtuple('Match', ('kind', 'label', 'query'))
+
+class LibraryIndex:
+    def __init__(self, path=INDEX_PATH, delay=UPDATE_DELAY):
+        self.path = os.path.expanduser(path)
+        self._local = threading.local() # sqlite connections are per thread
+        self.updater = Debouncer(delay, 'libindex') # latest request wins
+        self._lock = threading.Lock()
+        self._opened = False # meta read, the file is opened on first use
+        self.db_update = None
+        self.songs = 0
+        self.updating = False
+        self.builds = 0 # full builds
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL') # readers never wait on a build
+            db.create_function('t9', 1, t9, deterministic=True)
+            db.execute('CREATE TABLE IF NOT EXISTS meta'
+                       ' (key TEXT PRIMARY KEY, value TEXT)')
+            for (table, (columns, name)) in TABLES.items():
+                db.execute('CREATE TABLE IF NOT EXISTS '+table+' '+columns)
+            self._local.db = db
+        return db
+
+    def _meta(self, key):
+        try:
+            row = self._db().execute('SELECT value FROM meta WHERE key = ?',
+                                     (key,)).fetchone()
+        except sqlite3.Error as err:
+            logger.warning('library index '+self.path+': '+str(err))
+            return None
+        return row[0] if row else None
+
+    def _open(self):
+        with self._lock:
+            if not self._opened:
+                self._opened = True
+                self.db_update = self._meta('db_update')
+                self.songs = int(self._meta('songs') or 0)
+
+    def ready(self):
+        self._open()
+        return self.songs > 0
+
+    def start_update(self, connect):
+        """Checks the index against the server in the background. connect()
+        returns a connected mpd client the update disconnects when done.
+        """
+        self.updater.post(self.update, connect)
+
+    def update(self, connect):
+        try:
+            client = connect()
+        except (ConnectionError, SocketError, SocketTimeout, IOError) as err:
+            logger.info('library index not checked: '+str(err))
+            return False
+        try:
+            self._open()
+            db_update = client.stats().get('db_update')
+            if db_update is not None and db_update == self.db_update:
+                logger.debug('library index is current')
+                return False
+            self.build(client, db_update)
+            return True
+        except (CommandError, ConnectionError, SocketError, SocketTimeout,
+                IOError, sqlite3.Error) as err:
+            logger.warning('library index not updated: '+str(err))
+            return False
+        finally:
+            try:
+                client.disconnect()
+            except (ConnectionError, SocketError, SocketTimeout, IOError):
+                pass
+
+    def build(self, mpd_client, db_update=None):
+##      Assumes mpd_client is not shared while the listing streams
+        db = self._db()
+        self.updating = True
+        count = [0]
+        def rows():
+            iterate = getattr(mpd_client, 'iterate', False)
+            mpd_client.iterate = True
+            try:
+                for song in mpd_client.listallinfo():
+                    if 'file' not in song:
+                        continue
+                    (artist, album, title) = (_tag(song, 'artist'),
+                                              _tag(song, 'album'),
+                                              _tag(song, 'title'))
+                    if not title: # untagged, known by its file name
+                        title = song['file'].rsplit('/', 1)[-1]
+                    count[0] += 1
+                    yield (song['file'], artist, album, title, t9(title))
+            finally:
+                mpd_client.iterate = iterate
+        try:
+            db.execute('BEGIN')
+            for (table, (columns, name)) in TABLES.items():
+                db.execute('DROP TABLE IF EXISTS '+table+'_new')
+                db.execute('CREATE TABLE '+table+'_new '+columns)
+            db.executemany('INSERT INTO songs_new VALUES (?, ?, ?, ?, ?)', rows())
+            db.execute('INSERT INTO artists_new SELECT DISTINCT artist, t9(artist)'
+                       " FROM songs_new WHERE artist != ''")
+            db.execute('INSERT INTO albums_new SELECT DISTINCT album, artist,'
+                       " t9(album) FROM songs_new WHERE album != ''")
+            for (table, (columns, name)) in TABLES.items():
+                db.execute('DROP TABLE '+table)
+                db.execute('ALTER TABLE '+table+'_new RENAME TO '+table)
+                # indexed once the rows are in, in the order results are shown
+                db.execute('CREATE INDEX '+table+'_t9 ON '+table+
+                           ' (t9, '+name+')')
+            db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           [('db_update', db_update), ('songs', str(count[0]))])
+            db.execute('COMMIT')
+        except BaseException:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            self.updating = False
+        self.db_update = db_update
+        self.songs = count[0]
+        self.builds += 1
+        logger.info('library index built: '+str(count[0])+' songs')
+
+    def search(self, digits, limit=MAX_MATCHES):
+        """Artists, albums and titles whose T9 digits start with digits."""
+        if not digits:
+            return []
+        self._open()
+        bounds = (digits, digits+':') # ':' sorts right after '9'
+        matches = []
+        try:
+            db = self._db()
+            for (artist,) in db.execute(
+                    'SELECT artist FROM artists WHERE t9 >= ? AND t9 < ?'
+                    ' ORDER BY t9, artist LIMIT ?', bounds+(limit,)):
+                matches.append(Match('artist', artist, ('artist', artist)))
+            for (album, artist) in db.execute(
+                    'SELECT album, artist FROM albums WHERE t9 >= ? AND t9 < ?'
+                    ' ORDER BY t9, album LIMIT ?', bounds+(limit,)):
+                matches.append(Match('album', album+' - '+artist,
+                                     ('artist', artist, 'album', album)))
+            for (title, artist, uri) in db.execute(
+                    'SELECT title, artist, file FROM songs WHERE t9 >= ?'
+                    ' AND t9 < ? ORDER BY t9, title LIMIT ?', bounds+(limit,)):
+                matches.append(Match('title', title+' - '+artist, ('file', uri)))
+        except sqlite3.Error as err:
+            logger.warning('library search failed: '+str(err))
+        return matches
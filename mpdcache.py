@@ -0,0 +1,245 @@
+#! /usr/bin/python3
+
+"""
+Caches mpd database listings for the menu browser.
+Listings are kept in a least recently used cache capped by the total number
+of entries held, and are dropped when mpd reports a database change.
+The highlighted subdirectory can be prefetched in the background while the
+user is scrolling, so entering it is answered from memory.
+Stored playlists are read a page at a time on servers that can send ranges.
+Tag browsing caches the artists, the albums of an artist and the songs of
+an album the same way.
+"""
+
+import logging
+from collections import OrderedDict
+from threading import Lock
+from mpd import MPDClient
+from mpdlisting import (fetch_listing, fetch_tags)
+from scheduler import Debouncer
+
+logger = logging.getLogger('mpdcache')
+
+MAX_ENTRIES = 5000    # listing entries held by a cache
+PREFETCH_DELAY = 0.3  # seconds the cursor rests before prefetching
+PAGE_SIZE = 64        # stored playlist entries fetched at a time
+MAX_PAGES = 8         # stored playlist pages held
+MAX_TRACKS = 1000     # songs listed under one artist and album
+TAG_LEVELS = ('artist', 'album') # browsed by tag, then the songs
+
+if not hasattr(MPDClient, 'playlistlength'): # mpd 0.24, newer than python-mpd2
+    MPDClient.add_command('playlistlength', MPDClient._parse_object)
+
+class LRUCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self._lock = Lock()
+        self.max_entries = max_entries
+        self.listings = OrderedDict() # key -> listing
+        self.size = 0   # entries held in all listings
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self.listings:
+                self.listings.move_to_end(key)
+                self.hits += 1
+                return self.listings[key]
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.listings
+
+    def put(self, key, listing):
+        with self._lock:
+            if key in self.listings:
+                self.size -= len(self.listings.pop(key))
+            self.listings[key] = listing
+            self.size += len(listing)
+            # always keep the newest listing, even if it is over the cap
+            while self.size > self.max_entries and len(self.listings) > 1:
+                (oldkey, old) = self.listings.popitem(last=False)
+                self.size -= len(old)
+                logger.debug('dropped cached listing '+str(oldkey))
+
+    def clear(self):
+        with self._lock:
+            self.listings.clear()
+            self.size = 0
+        logger.debug('cache cleared')
+
+class DirectoryCache(LRUCache):
+    """lsinfo listings keyed by directory path. Subclasses cache other
+    listings by overriding read().
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, prefetch_delay=PREFETCH_DELAY,
+                 name='dirprefetch'):
+        super(DirectoryCache, self).__init__(max_entries)
+        self.prefetcher = Debouncer(prefetch_delay, name)
+        self.generation = 0 # bumped on invalidate to discard late fetches
+        self.fetches = 0    # listing round trips
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+        self.prefetcher.cancel()
+        self.clear()
+
+    def read(self, mpd_client, path):
+##      Assumes the mpd_client lock is acquired before calling
+        logger.debug('lsinfo '+path)
+        # stored playlists are browsed in their own menu
+        return fetch_listing(mpd_client, 'lsinfo', *([path] if path else []),
+                             skip=('playlist',))
+
+    def fetch(self, mpd_client, key):
+##      Assumes the mpd_client lock is acquired before calling
+        generation = self.generation
+        listing = self.read(mpd_client, key)
+        self.fetches += 1
+        if generation == self.generation:
+            self.put(key, listing)
+        return listing
+
+    def listing(self, mpd_client, key):
+##      Assumes the mpd_client lock is acquired before calling
+        listing = self.get(key)
+        if listing is None:
+            listing = self.fetch(mpd_client, key)
+        return listing
+
+    def _prefetch(self, mpd_client, key):
+        if key in self:
+            return
+        with mpd_client:
+            if key not in self:
+                logger.debug('prefetching '+str(key))
+                self.fetch(mpd_client, key)
+
+    def prefetch(self, mpd_client, key):
+        self.prefetcher.post(self._prefetch, mpd_client, key)
+
+class TagCache(DirectoryCache):
+    """Listings for browsing by tag, keyed by the tag values chosen so far:
+    () lists the artists, (artist,) their albums, (artist, album) the songs.
+    list has no window, so the tag levels are streamed into TagListings of
+    bare strings; the songs are fetched with a find window.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, prefetch_delay=PREFETCH_DELAY,
+                 max_tracks=MAX_TRACKS):
+        super(TagCache, self).__init__(max_entries, prefetch_delay, 'tagprefetch')
+        self.max_tracks = max_tracks
+
+    def read(self, mpd_client, path):
+##      Assumes the mpd_client lock is acquired before calling
+        filters = []
+        for (tag, value) in zip(TAG_LEVELS, path):
+            filters.extend([tag, value])
+        logger.debug('tag listing '+str(path))
+        if len(path) < len(TAG_LEVELS):
+            return fetch_tags(mpd_client, TAG_LEVELS[len(path)], *filters)
+        elif window_supported(mpd_client):
+            return fetch_listing(mpd_client, 'find', *filters, 'window',
+                                 '0:'+str(self.max_tracks))
+        return fetch_listing(mpd_client, 'find', *filters)
+
+PAGE_PREFETCHER = Debouncer(0.0, 'plsprefetch') # shared by all PagedPlaylists
+
+def _version(mpd_client):
+    try:
+        return tuple(int(part) for part in mpd_client.mpd_version.split('.')[0:2])
+    except (AttributeError, ValueError):
+        return (0, 0)
+
+def window_supported(mpd_client):
+##  find windows came with mpd 0.20
+    return _version(mpd_client) >= (0, 20)
+
+def ranges_supported(mpd_client):
+##  listplaylistinfo ranges and playlistlength came with mpd 0.24
+    return _version(mpd_client) >= (0, 24)
+
+class PagedPlaylist:
+    """A stored playlist read a page at a time. The first page is fetched
+    when the playlist is opened; the next page in the scroll direction is
+    fetched in the background once the cursor nears the edge of a page.
+    Servers without listplaylistinfo ranges get the whole playlist.
+    """
+    def __init__(self, name, page_size=PAGE_SIZE, max_pages=MAX_PAGES,
+                 prefetcher=PAGE_PREFETCHER):
+        self._lock = Lock()
+        self.name = name
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.length = 0
+        self.pages = OrderedDict() # page number -> Listing
+        self.prefetcher = prefetcher
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def open(self, mpd_client):
+##      Assumes the mpd_client lock is acquired before calling
+        if ranges_supported(mpd_client):
+            self.length = int(mpd_client.playlistlength(self.name).get('songs', 0))
+            if self.length > 0:
+                self._fetch(mpd_client, 0)
+        else:
+            listing = fetch_listing(mpd_client, 'listplaylistinfo', self.name)
+            self.page_size = max(len(listing), 1)
+            self.max_pages = 1
+            self.length = len(listing)
+            self.pages[0] = listing
+        logger.debug('playlist '+self.name+': '+str(self.length)+' entries')
+        return self
+
+    def _fetch(self, mpd_client, page):
+##      Assumes the mpd_client lock is acquired before calling
+        start = page * self.page_size
+        end = min(start + self.page_size, self.length)
+        logger.debug('listplaylistinfo '+self.name+' '+str(start)+':'+str(end))
+        listing = fetch_listing(mpd_client, 'listplaylistinfo', self.name,
+                                str(start)+':'+str(end))
+        with self._lock:
+            self.pages[page] = listing
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        return listing
+
+    def _prefetch(self, mpd_client, page):
+        if page in self.pages:
+            return
+        with mpd_client:
+            if page not in self.pages:
+                self._fetch(mpd_client, page)
+
+    def letter_index(self):
+##      only a playlist held whole has every name to index
+        with self._lock:
+            listing = self.pages.get(0)
+        if listing is None or len(listing) < self.length:
+            return None
+        return listing.letter_index()
+
+    def entry(self, mpd_client, index, direction=1):
+##      Assumes the mpd_client lock is acquired before calling
+        if index < 0 or index >= self.length:
+            return {}
+        page = index // self.page_size
+        with self._lock:
+            listing = self.pages.get(page)
+            if listing is not None:
+                self.pages.move_to_end(page)
+        if listing is None:
+            listing = self._fetch(mpd_client, page)
+        ahead = index + direction * max(self.page_size // 4, 1)
+        if 0 <= ahead < self.length and ahead // self.page_size not in self.pages:
+            self.prefetcher.post(self._prefetch, mpd_client,
+                                 ahead // self.page_size)
+        offset = index - page * self.page_size
+        return listing[offset] if offset < len(listing) else {}
@@ -0,0 +1,214 @@
+#! /usr/bin/python3
+
+"""
+Compact storage for long mpd listings.
+python-mpd2 returns one dictionary per entry holding every tag. The menus
+only show a label and act on the uri, so a Listing keeps just the entry
+kind, the uri and the label in parallel arrays of interned strings. Entries
+are read back as small ListEntry views that answer the dictionary lookups
+the menus make.
+A LetterIndex over a listing jumps between the groups of entries that
+start with the same letter. A TagListing keeps the values of one tag.
+"""
+
+import sys
+import logging
+from bisect import bisect_left, bisect_right
+
+logger = logging.getLogger('mpdlisting')
+
+KINDS = ('directory', 'file', 'playlist')
+
+def _intern(text):
+    return sys.intern(text) if type(text) is str else text
+
+def first_letter(text):
+##  letters group by their upper case, digits and the rest under '#'
+    for char in text or '':
+        if char.isalpha():
+            return char.upper()
+        if char.isalnum():
+            return '#'
+    return '#'
+
+def step_index(index, steps, length):
+##  single steps wrap around the list, accelerated steps stop at its ends
+    if abs(steps) == 1:
+        return (index + steps) % length
+    return min(max(index + steps, 0), length - 1)
+
+class LetterIndex:
+    """The first letter of every entry, and the sorted positions of the
+    entries under each letter. Jumps go to the first entry of the next or
+    previous letter in alphabetical order, so they work on unsorted lists
+    too; on a sorted list that is the start of the next group.
+    """
+    def __init__(self, names):
+        self.letters = ''.join(first_letter(name) for name in names)
+        self.groups = sorted(set(self.letters)) # letters present, in order
+        self.positions = {letter: [] for letter in self.groups}
+        for (index, letter) in enumerate(self.letters):
+            self.positions[letter].append(index)
+
+    def __len__(self):
+        return len(self.letters)
+
+    def letter(self, index):
+        return self.letters[index] if 0 <= index < len(self.letters) else ''
+
+    def next(self, index):
+        if not self.letters:
+            return 0
+        group = bisect_right(self.groups, self.letter(index))
+        return self.positions[self.groups[group % len(self.groups)]][0]
+
+    def prev(self, index):
+        if not self.letters:
+            return 0
+        letter = self.letter(index)
+        if letter in self.positions and self.positions[letter][0] != index:
+            return self.positions[letter][0] # to the top of this letter first
+        group = bisect_left(self.groups, letter) - 1
+        return self.positions[self.groups[group]][0]
+
+class ListEntry:
+    __slots__ = ('kind', 'uri', 'label')
+
+    def __init__(self, kind, uri, label):
+        self.kind = kind
+        self.uri = uri
+        self.label = label
+
+    def __contains__(self, key):
+        return key == self.kind or (key == 'title' and self.label is not None)
+
+    def __getitem__(self, key):
+        if key == self.kind:
+            return self.uri
+        if key == 'title' and self.label is not None:
+            return self.label
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return repr({self.kind: self.uri, 'title': self.label})
+
+class Listing:
+    def __init__(self, entries=(), skip=()):
+        self.kinds = bytearray()
+        self.uris = []
+        self.labels = []
+        self.index = None # LetterIndex, built on first use
+        self.extend(entries, skip)
+
+    def extend(self, entries, skip=()):
+##      entries may be a generator, each entry is dropped once stored
+        for entry in entries:
+            for kind in range(len(KINDS)):
+                if KINDS[kind] in entry:
+                    break
+            else:
+                continue
+            if KINDS[kind] in skip:
+                continue
+            label = entry.get('title', entry.get('name'))
+            if type(label) is list: # repeated tags come back as lists
+                label = label[0]
+            self.kinds.append(kind)
+            self.uris.append(_intern(entry[KINDS[kind]]))
+            self.labels.append(_intern(label))
+        self.index = None
+        return self
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __bool__(self):
+        return len(self.uris) > 0
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.uris)
+        if index < 0 or index >= len(self.uris):
+            raise IndexError(index)
+        return ListEntry(KINDS[self.kinds[index]], self.uris[index],
+                         self.labels[index])
+
+    def __iter__(self):
+        for index in range(len(self.uris)):
+            yield self[index]
+
+    def sort(self, key):
+        order = sorted(range(len(self.uris)), key=lambda i: key(self[i]))
+        self.kinds = bytearray(self.kinds[i] for i in order)
+        self.uris = [self.uris[i] for i in order]
+        self.labels = [self.labels[i] for i in order]
+        self.index = None
+        return self
+
+    def names(self):
+##      what the menus show: the title, else the last part of the uri
+        for (uri, label) in zip(self.uris, self.labels):
+            yield label if label is not None else uri.rsplit('/', 1)[-1]
+
+    def letter_index(self):
+        if self.index is None:
+            self.index = LetterIndex(self.names())
+        return self.index
+
+class TagListing:
+    """The values of one tag, as list sends them: interned strings in the
+    server's order.
+    """
+    def __init__(self, tag, values=()):
+        self.tag = tag
+        self.values = []
+        self.index = None # LetterIndex, built on first use
+        for value in values:
+            if type(value) is dict:
+                value = value.get(tag, '')
+            if type(value) is list: # repeated tags come back as lists
+                value = value[0]
+            self.values.append(_intern(value))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        return len(self.values) > 0
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def names(self):
+        return iter(self.values)
+
+    def letter_index(self):
+        if self.index is None:
+            self.index = LetterIndex(self.names())
+        return self.index
+
+def fetch_tags(mpd_client, tag, *filters):
+##  Assumes the mpd_client lock is acquired before calling.
+##  Streams the values so only the strings are kept.
+    iterate = getattr(mpd_client, 'iterate', False)
+    mpd_client.iterate = True
+    try:
+        return TagListing(tag, mpd_client.list(tag, *filters))
+    finally:
+        mpd_client.iterate = iterate
+
+def fetch_listing(mpd_client, command, *args, skip=()):
+##  Assumes the mpd_client lock is acquired before calling.
+##  Streams the reply so the full dictionaries are never all held at once.
+    iterate = getattr(mpd_client, 'iterate', False)
+    mpd_client.iterate = True
+    try:
+        return Listing(getattr(mpd_client, command)(*args), skip)
+    finally:
+        mpd_client.iterate = iterate
@@ -0,0 +1,336 @@
+#! /usr/bin/python3
+
+"""
+Manages the connections to the mpd server.
+Each role gets its own connection so that a slow command in one role never
+queues short commands in another:
+    command - short interactive commands: volume, transport, status
+    browse  - menu browsing: lsinfo, stored playlists, prefetching
+    idle    - the idle event loop
+A role is an MPDConnection: a lockable proxy for the mpd client currently
+serving it. When a client breaks it is swapped for an already connected
+warm spare, and a new spare is connected in the background. Failed connects
+are retried as the shared ReconnectStrategy allows.
+Jobs that wait on the role locks or the network, such as switching servers,
+are posted to the pool's own worker thread, so a caller holding a role lock,
+the scheduler thread or the event loop never waits on them.
+"""
+
+import socket
+import logging
+from collections import deque
+from threading import Lock, Condition, Thread
+from mpd import (MPDClient, CommandError, ConnectionError)
+from socket import error as SocketError
+from socket import timeout as SocketTimeout
+from mpdpreferences import (MpdPreferences, DISCOVERY)
+from reconnect import ReconnectStrategy
+
+logger = logging.getLogger('mpdpool')
+
+ROLES = ('command', 'browse', 'idle')
+SPARES = 1          # warm spare connections kept
+TIMEOUT = 15        # seconds, mpd socket timeout
+
+MPD_ERRORS = (CommandError, ConnectionError, SocketError, SocketTimeout, IOError)
+
+class MPDConnection(object):
+    _own = ('manager', 'role', 'client', '_lock')
+
+    def __init__(self, manager, role):
+        object.__setattr__(self, 'manager', manager)
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'client', manager.new_client())
+        object.__setattr__(self, '_lock', Lock())
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+    def release(self):
+        self._lock.release()
+    def __enter__(self):
+        self.acquire()
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    # everything else is the mpd client serving the role
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.client, name, value)
+
+class PoolWorker:
+    """Runs posted jobs in order on one background thread. A job already
+    waiting to run is not queued again.
+    """
+    def __init__(self, name='mpdpool'):
+        self.name = name
+        self._cond = Condition()
+        self._jobs = deque() # (function, args)
+        self._thread = None
+
+    def post(self, function, *args):
+        with self._cond:
+            if (function, args) not in self._jobs:
+                self._jobs.append((function, args))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                (function, args) = self._jobs.popleft()
+            try:
+                function(*args)
+            except Exception:
+                logger.exception('pool job '+str(function)+' failed')
+
+class MPDConnectionManager:
+    def __init__(self, config, roles=ROLES, spares=SPARES, timeout=TIMEOUT,
+                 reconnect=None, discovery=DISCOVERY):
+        self.config = config
+        self.timeout = timeout
+        self.nspares = spares
+        self.notify = lambda text, text2=None: None # connection messages
+        self._lock = Lock() # guards spares
+        self.spares = []
+        self.refilling = None
+        self.reconnect = reconnect if reconnect else ReconnectStrategy()
+        self.discovery = discovery
+        # a server appearing or moving is worth an immediate retry
+        discovery.listeners.append(self.reconnect.wake)
+        self.healthy = True # all roles answered the last check
+        self.listeners = [] # called on a failover, from its thread
+        self.worker = PoolWorker()
+        self.connections = {}
+        for role in roles:
+            self.connections[role] = MPDConnection(self, role)
+        self.connects = 0   # successful connects
+        self.failovers = 0  # broken clients replaced
+
+    def __getitem__(self, role):
+        return self.connections[role]
+
+    def post(self, function, *args):
+        """Runs function(*args) on the pool worker thread."""
+        self.worker.post(function, *args)
+
+    def new_client(self):
+        client = MPDClient()
+        client.timeout = self.timeout
+        return client
+
+    def _connect(self, client, label):
+        wait = self.reconnect.remaining()
+        if wait > 0:
+            raise ConnectionError('retry in '+str(int(wait)+1)+' secs')
+        mpdrec = MpdPreferences(self.discovery).preferredClient(self.config)
+        if not mpdrec['host']: # the mpd server had gone off-line
+            self._failed()
+            raise ConnectionError('server '+str(mpdrec['name'])+
+                                  ' is no longer available')
+        logger.info(label+' connecting to '+mpdrec['name'])
+        try:
+            client.connect(mpdrec['host'], mpdrec['port'])
+        except ConnectionError as err:
+            if str(err) != "already connected":
+                self._failed()
+                raise
+        except (SocketError, SocketTimeout, IOError):
+            self._failed()
+            raise
+        self.reconnect.succeeded()
+        self.connects += 1
+        logger.info(label+' connected to '+mpdrec['name'])
+
+    def open_client(self, label):
+        """A connected client of no role, for a long job such as indexing
+        the library. The caller disconnects it.
+        """
+        client = self.new_client()
+        self._connect(client, label)
+        return client
+
+    def _failed(self):
+        self.reconnect.failed()
+        # the server may have moved, look again before the next retry
+        self.discovery.start_refresh()
+
+    def _disconnect(self, client):
+        try:
+            client.disconnect()
+        except MPD_ERRORS:
+            pass
+
+    def interrupt(self, conn):
+        """Ends a wait on the role's socket from another thread: the waiting
+        read fails and the waiting thread reconnects or stops on its own.
+        """
+        try:
+            sock = socket.fromfd(conn.client.fileno(), socket.AF_INET,
+                                 socket.SOCK_STREAM)
+        except MPD_ERRORS:
+            return
+        with sock: # a duplicate, shutting it down shuts down the connection
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except SocketError:
+                pass
+
+    def connect(self, conn):
+##      Assumes the conn lock is acquired before calling
+        try:
+            self._connect(conn.client, conn.role)
+            self.notify(conn.role+' connected')
+            return True
+        except MPD_ERRORS as err:
+            logger.warning(conn.role+' connect failed: '+str(err))
+            self.notify(conn.role+' connect failed', str(err))
+            return False
+
+    def _connect_role(self, conn):
+        if conn.role == 'idle':
+            # a waiting idle loop reconnects its own connection
+            if conn.acquire(False):
+                try:
+                    self.connect(conn)
+                finally:
+                    conn.release()
+        else:
+            with conn:
+                self.connect(conn)
+
+    def connect_all(self):
+        # the roles connect in parallel, a startup waits for one round trip
+        threads = []
+        for conn in self.connections.values():
+            thread = Thread(target=self._connect_role, args=(conn,),
+                            name='connect-'+conn.role)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.start_refill()
+
+    def failover(self, conn):
+##      Assumes the conn lock is acquired before calling.
+##      Returns True when the role has a connected client again.
+        self._disconnect(conn.client)
+        for listener in list(self.listeners):
+            listener() # the server may have restarted with another state
+        while True:
+            with self._lock:
+                spare = self.spares.pop() if self.spares else None
+            if spare is None:
+                break
+            try:
+                spare.ping() # a restarted server closed the spares too
+            except MPD_ERRORS as err:
+                logger.debug('warm spare broken too: '+str(err))
+                self._disconnect(spare)
+                continue
+            logger.info(conn.role+' switched to a warm spare connection')
+            conn.client = spare
+            self.failovers += 1
+            self.start_refill()
+            return True
+        conn.client = self.new_client()
+        connected = self.connect(conn)
+        self.start_refill()
+        return connected
+
+    def ping(self, conn):
+##      health check, returns False if the role is still broken
+        if not conn.acquire(False): # a command underway shows it is alive
+            return True
+        try:
+            try:
+                conn.client.ping()
+                return True
+            except MPD_ERRORS as err:
+                logger.info(conn.role+' health check failed: '+str(err))
+                return self.failover(conn)
+        finally:
+            conn.release()
+
+    def check(self):
+##      health check of the command roles and the spares, keeps them alive.
+##      Returns True when all the command roles are connected. Blocks on
+##      the network, so it is posted to the worker.
+        healthy = True
+        for conn in self.connections.values():
+            if conn.role != 'idle': # the idle loop checks its own connection
+                healthy = self.ping(conn) and healthy
+        with self._lock:
+            spares = self.spares
+            self.spares = []
+        for spare in spares:
+            try:
+                spare.ping()
+                with self._lock:
+                    self.spares.append(spare)
+            except MPD_ERRORS:
+                self._disconnect(spare)
+        self.start_refill()
+        self.healthy = healthy
+        return healthy
+
+    def _refill(self):
+        while True:
+            with self._lock:
+                if len(self.spares) >= self.nspares:
+                    self.refilling = None
+                    return
+            client = self.new_client()
+            try:
+                self._connect(client, 'spare')
+            except MPD_ERRORS as err:
+                logger.debug('spare connect failed: '+str(err))
+                with self._lock:
+                    self.refilling = None
+                return
+            with self._lock:
+                self.spares.append(client)
+
+    def start_refill(self):
+        with self._lock:
+            if self.refilling or len(self.spares) >= self.nspares:
+                return
+            self.refilling = Thread(target=self._refill, name='mpdspare')
+            self.refilling.daemon = True
+            self.refilling.start()
+
+    def disconnect_all(self):
+        for conn in self.connections.values():
+            if conn.role == 'idle':
+                # the idle loop holds its lock while waiting, interrupt it
+                self.interrupt(conn)
+                if conn.acquire(False):
+                    try:
+                        self._disconnect(conn.client)
+                    finally:
+                        conn.release()
+            else:
+                with conn:
+                    self._disconnect(conn.client)
+        with self._lock:
+            spares = self.spares
+            self.spares = []
+        for spare in spares:
+            self._disconnect(spare)
+        logger.debug('all mpd connections closed')
+
+    def reconnect_all(self):
+##      Waits for the role locks, so it must not run on a thread holding
+##      one: post() it from there
+        self.disconnect_all()
+        self.reconnect.reset() # a new server deserves an immediate try
+        self.connect_all()
@@ -1,15 +1,33 @@
 #! /usr/bin/python3
 import os
+import time
 import subprocess
 import logging
 import configparser
+from threading import Lock, RLock, Thread
 
 logger = logging.getLogger('mpdmanager')
 
-class MpdPreferences:
-    def __init__(self):
-        self.mpd_services_list = []
-        
+DISCOVERY_TTL = 300.0 # seconds before avahi results are refreshed
+
+class MpdDiscovery:
+    """Process wide registry of the mpd servers found by avahi.
+    Results are answered from memory; once they are older than ttl seconds
+    a background thread refreshes them. Only the very first lookup waits
+    for avahi-browse. listeners are called when the servers found change.
+    """
+    def __init__(self, ttl=DISCOVERY_TTL):
+        self._lock = Lock()
+        self._browsing = RLock()
+        self.ttl = ttl
+        self.mpd_services_list = None
+        self.timestamp = 0.0
+        self.refreshing = None
+        self.listeners = []
+        self.browses = 0 # avahi-browse runs
+
+    def browse(self):
+        mpd_services_list = []
 # Need avahi-utils installed
         try:
             logger.debug('starting avahi search for mpd servers')
@@ -24,7 +42,7 @@ class MpdPreferences:
                 mpd_service_list = mpd_service.split(";")
                 if mpd_service_list[0] == "=":
                     logger.debug('found mpd service: '+mpd_service_list[3])
-                    self.mpd_services_list.append({'name':mpd_service_list[3].replace("\\032"," "),
+                    mpd_services_list.append({'name':mpd_service_list[3].replace("\\032"," "),
                              'host':mpd_service_list[6],
                              'address':mpd_service_list[7],
                              'port':mpd_service_list[8]})
@@ -38,10 +56,59 @@ class MpdPreferences:
             logger.info('Will fallback to staticpreferences to locate an mpd server.')
         
         # add local host option
-        self.mpd_services_list.append({'name':'localhost',
-                                       'host':'localhost',
-                                       'address':'127.0.0.1',
-                                       'port':'6600'})
+        mpd_services_list.append({'name':'localhost',
+                                  'host':'localhost',
+                                  'address':'127.0.0.1',
+                                  'port':'6600'})
+        return mpd_services_list
+
+    def refresh(self):
+        with self._browsing: # one avahi-browse at a time
+            return self._refresh()
+
+    def _refresh(self):
+        mpd_services_list = self.browse()
+        with self._lock:
+            changed = (self.mpd_services_list is not None and
+                       mpd_services_list != self.mpd_services_list)
+            if mpd_services_list != self.mpd_services_list:
+                logger.info('mpd servers: '+
+                            ', '.join(d['name'] for d in mpd_services_list))
+            self.mpd_services_list = mpd_services_list
+            self.timestamp = time.monotonic()
+            self.browses += 1
+            self.refreshing = None
+        if changed:
+            for listener in list(self.listeners):
+                listener()
+        return mpd_services_list
+
+    def start_refresh(self):
+        with self._lock:
+            if self.refreshing:
+                return
+            self.refreshing = Thread(target=self.refresh, name='avahi')
+            self.refreshing.daemon = True
+            self.refreshing.start()
+
+    def services(self):
+        with self._lock:
+            mpd_services_list = self.mpd_services_list
+            stale = time.monotonic() - self.timestamp > self.ttl
+        if mpd_services_list is None: # first lookup has to wait for avahi
+            with self._browsing: # or for the refresh already underway
+                if self.mpd_services_list is not None:
+                    return self.mpd_services_list
+                return self.refresh()
+        if stale:
+            self.start_refresh()
+        return mpd_services_list
+
+DISCOVERY = MpdDiscovery()
+
+class MpdPreferences:
+    def __init__(self, discovery=DISCOVERY):
+        self.mpd_services_list = discovery.services()
 
     def mpdnames(self):
         mpdnamelist = []
@@ -0,0 +1,139 @@
+#! /usr/bin/python3
+
+"""
+Mirrors the mpd play queue for the play queue menus.
+The mirror is keyed on the playlist version reported by status. When the
+version changes only the positions changed since the mirrored version are
+fetched with plchangesposid, so adding one song to a long queue costs one
+small delta instead of a reload.
+Song entries are fetched a window at a time with playlistinfo start:end,
+biased in the direction the user is scrolling, and kept by song id.
+The mirror is shared by all mpd clients.
+"""
+
+import logging
+from collections import OrderedDict
+from threading import Lock
+from mpd import CommandError
+
+logger = logging.getLogger('playqueue')
+
+WINDOW_SIZE = 32    # entries fetched by each playlistinfo call
+WINDOW_BEHIND = 4   # entries fetched behind the cursor
+MAX_ENTRIES = 256   # song entries kept before the least recent are dropped
+
+class PlayQueueCache:
+    def __init__(self, window_size=WINDOW_SIZE, max_entries=MAX_ENTRIES):
+        self._lock = Lock()
+        self.window_size = window_size
+        self.max_entries = max(max_entries, window_size)
+        self.version = None # mirrored playlist version, None if not synced
+        self.length = None  # play queue length, None if not known
+        self.ids = []       # queue position -> song id, None if not known
+        self.songs = OrderedDict() # song id -> mpd song dictionary
+        self.direction = 1  # last scroll direction: 1 down, -1 up
+        self.fetches = 0    # playlistinfo round trips
+        self.deltas = 0     # plchangesposid round trips
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+            self.length = None
+            self.ids = []
+            self.songs.clear()
+        logger.debug('play queue mirror invalidated')
+
+    def scroll(self, direction):
+        self.direction = 1 if direction >= 0 else -1
+
+    def sync(self, mpd_client, status=None):
+##      Assumes the mpd_client lock is acquired before calling
+        if status is None:
+            status = mpd_client.status()
+        if 'playlist' not in status or 'playlistlength' not in status:
+            self.invalidate()
+            return self
+        version = int(status['playlist'])
+        length = int(status['playlistlength'])
+        with self._lock:
+            oldversion = self.version
+            if oldversion == version:
+                return self
+            if oldversion is None:
+                logger.debug('play queue mirror started at version '+
+                             str(version))
+                self.version = version
+                self.length = length
+                self.ids = [None] * length
+                return self
+        changes = mpd_client.plchangesposid(oldversion)
+        with self._lock:
+            self.deltas += 1
+            if self.version != oldversion:
+                logger.debug('play queue synced by another client, discarding')
+                return self
+            logger.debug('play queue version '+str(oldversion)+' -> '+
+                         str(version)+': '+str(len(changes))+' changes')
+            ids = self.ids[:length]
+            ids.extend([None] * (length - len(ids)))
+            for change in changes:
+                pos = int(change['cpos'])
+                if pos < length:
+                    if ids[pos] == change['id']:
+                        # same song at the same place: its tags changed
+                        self.songs.pop(change['id'], None)
+                    ids[pos] = change['id']
+            self.ids = ids
+            self.length = length
+            self.version = version
+        return self
+
+    def _window(self, index):
+        if self.direction > 0:
+            start = max(0, index - WINDOW_BEHIND)
+            end = min(self.length, start + self.window_size)
+        else:
+            end = min(self.length, index + WINDOW_BEHIND + 1)
+            start = max(0, end - self.window_size)
+        return start, end
+
+    def _cached(self, index):
+##      Assumes _lock is acquired before calling
+        songid = self.ids[index]
+        if songid is not None and songid in self.songs:
+            self.songs.move_to_end(songid)
+            return self.songs[songid]
+        return None
+
+    def entry(self, mpd_client, index):
+##      Assumes the mpd_client lock is acquired before calling
+        with self._lock:
+            if self.length is None or index < 0 or index >= self.length:
+                return {}
+            song = self._cached(index)
+            if song is not None:
+                return song
+            (start, end) = self._window(index)
+            version = self.version
+        logger.debug('fetching play queue window '+str(start)+':'+str(end))
+        try:
+            songs = mpd_client.playlistinfo(str(start)+':'+str(end))
+        except CommandError as err: # window outside the queue, queue changed
+            logger.debug('play queue window fetch failed: '+str(err))
+            self.invalidate()
+            return {}
+        with self._lock:
+            self.fetches += 1
+            if version != self.version or self.length is None:
+                logger.debug('play queue changed during fetch, discarding')
+                return {}
+            for song in songs:
+                pos = int(song['pos'])
+                if pos < self.length:
+                    self.ids[pos] = song['id']
+                    self.songs[song['id']] = song
+                    self.songs.move_to_end(song['id'])
+            while len(self.songs) > self.max_entries:
+                self.songs.popitem(last=False)
+            song = self._cached(index)
+            return song if song is not None else {}
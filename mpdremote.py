@@ -2,23 +2,57 @@
 import sys
 import os
 import time
-import threading
 import argparse
+from ast import literal_eval
 import logging
 import configparser
 from time import localtime, strftime
-from threading import Lock, Thread, Barrier
+from threading import Thread, Barrier
 import pifacecad
-from mpd import (MPDClient, CommandError, ConnectionError, PendingCommandError)
+from mpd import (CommandError, ConnectionError, PendingCommandError)
 from socket import error as SocketError
 from socket import timeout as SocketTimeout
+import asyncio
 import pydaemon
 from fsm import (Fsm, State)
-from weather import WeatherStation
+from weather import (WeatherStation, WeatherFetcher, MAX_AGE, FETCH_TIMEOUT)
 from pifacemarquee import LockableMarquee
-from mpdpreferences import MpdPreferences
+from scheduler import SCHEDULER
+from displayqueue import (DisplayQueue, MIN_INTERVAL)
+from mpdpreferences import (MpdPreferences, DISCOVERY, DISCOVERY_TTL)
+from mpdqueue import PlayQueueCache
+from mpdcache import (DirectoryCache, TagCache, PagedPlaylist, MAX_ENTRIES,
+                      TAG_LEVELS)
+from mpdlisting import (fetch_listing, step_index)
+from mpdpool import (MPDConnectionManager, TIMEOUT)
+from preferenceschema import PreferenceSchema
+from preferencestore import (PreferenceStore, SAVE_DELAY)
+from libraryindex import (LibraryIndex, INDEX_PATH)
+from queueindex import QueueIndex
+from irdispatch import EventDispatcher
+from asyncruntime import (AsyncRuntime, AsyncDisplayQueue, wait_readable,
+                          LOCK_POLL)
 from select import select
 
+class StartupTimings:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last = self.started
+        self.phases = [] # (name, seconds)
+
+    def phase(self, name):
+        now = time.monotonic()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        logging.info('startup: '+
+                     ', '.join(name+' {:.3f}s'.format(secs)
+                               for (name, secs) in self.phases)+
+                     '; total {:.3f}s'.format(self.last - self.started))
+
+STARTUP = StartupTimings() # module load is the first phase
+
 config = configparser.ConfigParser()
 config.read_dict({'preferences': {'volumeincrement': '10',
                                   'backlight_duration': '30.0',
@@ -33,40 +67,39 @@ config.read(['/etc/mpdremoterc', # add to install when finished development
              os.path.expanduser('~/.mpdremoteprefs'), #dyn prefs recorded here
              ])
 
+PLAYQUEUE = PlayQueueCache() # play queue mirror shared by all mpd connections
+QUEUEINDEX = QueueIndex()     # play queue titles, for jumping to a song
+DIRCACHE = DirectoryCache(   # database listings, dropped on database changes
+    config['staticpreferences'].getint('dircache_max_entries', MAX_ENTRIES))
+TAGCACHE = TagCache(         # tag browse listings, dropped on database changes
+    config['staticpreferences'].getint('dircache_max_entries', MAX_ENTRIES))
+
 class PreferenceMenu:
-    def __init__(self, configparser):
+    def __init__(self, configparser, schema, store):
         self.config = configparser
-        self.menus = []
-        self.nmenus = len(self.menus)
+        self.schema = schema
+        self.store = store
+        self.menus = None # parsed once, when the menus are first entered
+        self.nmenus = 0
         self.currmenu = 0
         self.label = None
         self.choices = []
         self.currchoice = 0
         self.currvalue = None
         self.nchoices = 0
-        self.refresh()
     
     def refresh(self):
-        menulabels = eval(self.config['preferencemenu'].get('menu_choices','()'))
-        self.menus = []
-        for menulabel in menulabels:
-            menu = menulabel.split()[0]
-            menuchoices = eval(self.config['preferencemenu'].get(menu+'_choices'))
-            menuvalue = self.config['preferencemenu'].get(menu+'_value')
-            menuonchange = self.config['preferencemenu'].get(menu+'_on_value_change',
-                                                             'pass')
-            self.menus.append({'label':menulabel,
-                               'choices':menuchoices,
-                               'value':menuvalue,
-                               'on_change':menuonchange,
-                               })
+        # the menus are parsed once, entering them again only resets the cursor
+        if self.menus is None:
+            section = (self.config['preferencemenu']
+                       if 'preferencemenu' in self.config else {})
+            self.menus = self.schema.parse(section).items
         self.nmenus = len(self.menus)
         self.currmenu = 0
         self.label = None
         self.choices = []
         self.currchoice = 0
         self.nchoices = 0
-##        print(self.menus)
         return self
     
     def save(self):
@@ -76,8 +109,8 @@ class PreferenceMenu:
         try:
             if self.nmenus > 0:
                 menu = self.menus[self.currmenu]
-                label = menu['label']
-                value = self.config['preferences'][menu['value']]
+                label = menu.label
+                value = self.config['preferences'][menu.key]
                 return [label, [left,updown,right,' ',value]]
         except KeyError as ke:
             logging.error('"'+str(ke)+'" not found in preferences')
@@ -93,11 +126,10 @@ class PreferenceMenu:
 
     def startchoice(self):
         menu = self.menus[self.currmenu]
-##        print(menu)
-        self.label = menu['label']
-        self.choices = menu['choices']
+        self.label = menu.label
+        self.choices = menu.choices() # dynamic choices are computed only here
         self.nchoices = len(self.choices)
-        self.currvalue = self.config['preferences'].get(menu['value'], 'not set')
+        self.currvalue = self.config['preferences'].get(menu.key, 'not set')
 ##        print(value)
         try:
             self.currchoice = self.choices.index(self.currvalue)
@@ -112,30 +144,19 @@ class PreferenceMenu:
         menu = self.menus[self.currmenu]
         value = self.choices[self.currchoice]
         if self.currvalue != value:
-            self.config.set('preferences', menu['value'], value)
-            logging.info('set preferences: '+menu['value']+' = '+value)
+            self.config.set('preferences', menu.key, value)
+            logging.info('set preferences: '+menu.key+' = '+value)
             self.savechoices()
-            try:
-                if menu['on_change'] != 'pass':
-                    logging.debug('on_change: eval('+menu['on_change']+')')
-                    eval(menu['on_change'])
-                    logging.debug('on_change: exit eval('+menu['on_change']+')')
-            except NameError:
-                logging.warning(menu['label']+' changed, but '+menu['on_change']+' not found')
+            if menu.on_change:
+                logging.debug('on_change: '+menu.on_change_name)
+                menu.on_change()
+                logging.debug('on_change: exit '+menu.on_change_name)
         else:
             logging.debug('No change in preference')
     
     def savechoices(self):
-        preferences = self.config['preferences']
-        try:
-            fd = open(os.path.expanduser('~/.mpdremoteprefs'),'w')
-            fd.write("[preferences]\n")
-            for key in preferences:
-                value = preferences[key].replace('%', '%%') # escape % characters
-                fd.write('    '+key+" = "+value+"\n")
-            fd.close()
-        except IOError as err:
-            logging.warning('cannot save preference change to .mpdremoteprefs: '+ str(err))
+        # written in the background once the choices settle
+        self.store.changed()
     
     def upchoice(self):
         self.currchoice = (self.currchoice - 1) % len(self.choices)
@@ -145,20 +166,6 @@ class PreferenceMenu:
         self.currchoice = (self.currchoice + 1) % len(self.choices)
         return self.show()
 
-class LockableMPDClient(MPDClient):
-    def __init__(self, use_unicode=False):
-        super(LockableMPDClient, self).__init__()
-        self.use_unicode = use_unicode
-        self._lock = Lock()
-    def acquire(self):
-        self._lock.acquire()
-    def release(self):
-        self._lock.release()
-    def __enter__(self):
-        self.acquire()
-    def __exit__(self, type, value, traceback):
-        self.release()
-
 class MPDSongEntry:
     def __init__(self, mpd_song_dictionary):
         self.entry = mpd_song_dictionary
@@ -232,7 +239,7 @@ class MPDStatus:
         else:
             return ''
     
-    def volume (self, event=None):
+    def volume (self, event=None, steps=1):
         if len(self.refresh().status) > 0:
             try:
                 volume = int(self.status['volume'])
@@ -240,9 +247,9 @@ class MPDStatus:
                     'volumeincrement')
                 if event:
                     if event == 'volumeup':
-                        volume += volumeincr
+                        volume += volumeincr * steps
                     elif event == 'volumedown':
-                        volume -= volumeincr
+                        volume -= volumeincr * steps
                     volume = max(volume, 0)
                     volume = min(volume,100)
                     self.mpd_client.setvol(str(volume))
@@ -252,15 +259,15 @@ class MPDStatus:
         else:
             return ''
     
-    def time(self, event=None):
+    def time(self, event=None, steps=1):
         try:
             if event:
                 pos = int(self.refresh().status['time'].split(':')[0])
                 song = self.status['song']
                 if event == 'advance':
-                    pos += 10
+                    pos += 10 * steps
                 elif event == 'replay':
-                    pos -= 10
+                    pos = max(pos - 10 * steps, 0)
                 self.mpd_client.seek(song, str(pos))
             else:
                 return self.refresh().status['time']
@@ -284,11 +291,73 @@ class MPDStatus:
             return [0,0]
         return [int(self.status['song']), int(self.status['playlistlength'])]
 
+class MPDSnapshot:
+    def __init__(self, mpd_client, queue_cache=PLAYQUEUE):
+        self.mpd_client = mpd_client
+        self.queue = queue_cache
+        self.status = {}
+        self.song = {}
+    
+    def fetch(self):
+##      status and currentsong in one round trip, consistent with each other
+        try:
+            self.mpd_client.command_list_ok_begin()
+            self.mpd_client.status()
+            self.mpd_client.currentsong()
+            (self.status, self.song) = self.mpd_client.command_list_end()
+            self.queue.sync(self.mpd_client, self.status)
+        except (ConnectionError, SocketError, SocketTimeout, IOError):
+            self.status = {}
+            self.song = {}
+        return self
+    
+    def songentry(self):
+        if self.song:
+            return MPDSongEntry(self.song)
+        if int(self.status.get('playlistlength', '0')) <= 0:
+            return MPDSongEntry({'title': 'no play queue', 'album': ''})
+        return MPDSongEntry(self.queue.entry(self.mpd_client, 0))
+    
+    def volume(self):
+        if 'volume' in self.status:
+            return 'volume: ' + self.status['volume'] + '%'
+        return ''
+    
+    def playerstate(self):
+        return (self.status.get('state', '')+' at '+
+                self.status.get('time', ''))
+
+class MPDNowPlaying:
+    def __init__(self):
+        self.snapshot = None # replaced whole, so readers need no lock
+        self.taken = 0.0
+    
+    def publish(self, snapshot):
+        if snapshot.status:
+            self.taken = time.monotonic()
+            self.snapshot = snapshot
+    
+    def elapsed(self):
+##      song time from the snapshot, advanced by the time since it was taken
+        snapshot = self.snapshot
+        if not snapshot or 'time' not in snapshot.status:
+            return ' '
+        (elapsed, total) = snapshot.status['time'].split(':')
+        elapsed = int(elapsed)
+        if snapshot.status.get('state') == 'play':
+            elapsed += int(time.monotonic() - self.taken)
+            if int(total) > 0:
+                elapsed = min(elapsed, int(total))
+        return str(elapsed)+':'+total
+
+NOWPLAYING = MPDNowPlaying() # current song, filled by the idle event displays
+
 class MPDPlaylist:
     def __init__(self, mpd_client, playlist_name=None):
         self.mpd_client = mpd_client
         self.index = 0
         self.listlen = 0
+        self.direction = 1
         self.playlistnm = None
         self.playlist = None
         if playlist_name:
@@ -297,45 +366,68 @@ class MPDPlaylist:
     def fetch(self, playlist_name):
         try:
             self.playlistnm = playlist_name
-            self.playlist = self.mpd_client.listplaylistinfo(playlist_name)
+            self.playlist = PagedPlaylist(playlist_name).open(self.mpd_client)
             self.listlen = len(self.playlist)
             self.index = 0
+            self.direction = 1
         except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
             self.index = 0
             self.listlen = 0
             self.playlistnm = None
             self.playlist = None
     
+    def entry(self):
+        return self.playlist.entry(self.mpd_client, self.index, self.direction)
+    
     def title(self):
         if self.playlist:
-            song = MPDSongEntry(self.playlist[self.index])
+            song = MPDSongEntry(self.entry())
             return song.title()
         else:
             return 'no playlist'
     
-    def uptitle(self):
+    def uptitle(self, steps=1):
+        # the title is fetched when it is shown, not at every step
         if self.playlist:
-            self.index = self.index - 1 if self.index > 0 else self.listlen -1
-            return self.title()
-        else:
-            return 'no playlist'
+            self.index = step_index(self.index, -steps, self.listlen)
+            self.direction = -1
     
-    def downtitle(self):
+    def downtitle(self, steps=1):
         if self.playlist:
-            self.index = self.index + 1 if self.index < self.listlen-1 else 0
-            return self.title()
-        else:
-            return 'no playlist'
+            self.index = step_index(self.index, steps, self.listlen)
+            self.direction = 1
     
-    def select(self, playnow=False):
+    def nextgroup(self):
         if self.playlist:
-            logging.info('Adding '+self.playlist[self.index]['file']+' to playqueue')
-            addedid = self.mpd_client.addid(self.playlist[self.index]['file'])
+            index = self.playlist.letter_index()
+            if index is not None:
+                self.index = index.next(self.index)
+            else: # a paged playlist jumps a page
+                self.index = step_index(self.index, self.playlist.page_size,
+                                        self.listlen)
+            self.direction = 1
+    
+    def prevgroup(self):
+        if self.playlist:
+            index = self.playlist.letter_index()
+            if index is not None:
+                self.index = index.prev(self.index)
+            else:
+                self.index = step_index(self.index, -self.playlist.page_size,
+                                        self.listlen)
+            self.direction = -1
+    
+    def select(self, playnow=False):
+        entry = self.entry() if self.playlist else {}
+        if 'file' in entry:
+            logging.info('Adding '+entry['file']+' to playqueue')
+            addedid = self.mpd_client.addid(entry['file'])
             if playnow: self.mpd_client.playid(addedid)
 
 class MPDCurrentPlaylist:
-    def __init__(self, mpd_client):
+    def __init__(self, mpd_client, queue_cache=PLAYQUEUE):
         self.mpd_client = mpd_client
+        self.queue = queue_cache
         self.index = None
         self.currplslen = 0
 
@@ -354,24 +446,31 @@ class MPDCurrentPlaylist:
             else:
                 self.index = 0
             self.currplslen = int(status['playlistlength'])
+            self.queue.sync(self.mpd_client, status)
         except (ConnectionError, SocketError, SocketTimeout, IOError):
             self.index = None
             self.currplslen = 0
         return self
     
     def refresh(self):
-        try:
-            status = self.mpd_client.status()
-            if 'playlistlength' not in status:
+        if self.queue.length is not None: # mirror is synced by updatelist()
+            self.currplslen = self.queue.length
+        else:
+            try:
+                status = self.mpd_client.status()
+                if 'playlistlength' not in status:
+                    self.index = None
+                    self.currplslen = 0
+                    logging.debug('MPDCurrentPlaylist.refresh: no play queue')
+                    logging.debug(str(status))
+                else:
+                    self.currplslen = int(status['playlistlength'])
+                    self.queue.sync(self.mpd_client, status)
+            except (ConnectionError, SocketError, SocketTimeout, IOError):
                 self.index = None
                 self.currplslen = 0
-                logging.debug('MPDCurrentPlaylist.refresh: no play queue')
-                logging.debug(str(status))
-            else:
-                self.currplslen = int(status['playlistlength'])
-        except (ConnectionError, SocketError, SocketTimeout, IOError):
-            self.index = None
-            self.currplslen = 0
+        if self.currplslen > 0: # a queue filled since updatelist() had none
+            self.index = min(max(0, self.index or 0), self.currplslen - 1)
         return self
     
     def songentry(self, index=None):
@@ -384,25 +483,27 @@ class MPDCurrentPlaylist:
             self.index = index
             logging.debug('MPDCurrentPlaylist song idx set to '+str(self.index))
         self.index = min(max(0, self.index),plsmaxidx)
-        return MPDSongEntry(self.mpd_client.playlistid()[self.index])
+        return MPDSongEntry(self.queue.entry(self.mpd_client, self.index))
     
     def song(self):
         return self.songentry().title()
 
-    def upsong(self):
+    def upsong(self, steps=1):
         self.refresh()
         if self.currplslen <= 0:
             return 'no play queue'
         plsmaxidx = self.currplslen - 1
-        self.index = min(max(0, self.index - 1),plsmaxidx)
+        self.index = min(max(0, self.index - steps),plsmaxidx)
+        self.queue.scroll(-1)
         logging.debug('MPDCurrentPlaylist song idx set to '+str(self.index))
 
-    def downsong(self):
+    def downsong(self, steps=1):
         self.refresh()
         if self.currplslen <= 0:
             return 'no play queue'
         plsmaxidx = self.currplslen - 1
-        self.index = min(max(0, self.index + 1),plsmaxidx)
+        self.index = min(max(0, self.index + steps),plsmaxidx)
+        self.queue.scroll(1)
         logging.debug('MPDCurrentPlaylist song idx set to '+str(self.index))
 
     def selectsong(self):
@@ -413,7 +514,7 @@ class MPDCurrentPlaylist:
         self.index = min(max(0, self.index),plsmaxidx)
         logging.info(
                 'Selecting <'+
-                MPDSongEntry(self.mpd_client.playlistid()[self.index]).title()+
+                MPDSongEntry(self.queue.entry(self.mpd_client, self.index)).title()+
                 '> in playqueue')
         self.mpd_client.play(str(self.index))
     
@@ -425,13 +526,15 @@ class MPDCurrentPlaylist:
         self.index = min(max(0, self.index),plsmaxidx)
         logging.info(
                 'Deleting <'+
-                MPDSongEntry(self.mpd_client.playlistid()[self.index]).title()+
+                MPDSongEntry(self.queue.entry(self.mpd_client, self.index)).title()+
                 '> from playqueue')
         self.mpd_client.delete(str(self.index))
+        self.queue.sync(self.mpd_client) # positions after the deleted song shifted
     
     def clearlist(self):
         logging.info('Clearing playlist')
         self.mpd_client.clear()
+        self.queue.sync(self.mpd_client)
 
 class MPDPlaylists:
     def __init__(self, mpd_client):
@@ -442,8 +545,8 @@ class MPDPlaylists:
 
     def refresh(self):
         try:
-            self.playlists = sorted(self.mpd_client.listplaylists(),
-                                    key=lambda item: item['playlist'].lower())
+            self.playlists = fetch_listing(self.mpd_client, 'listplaylists').sort(
+                key=lambda item: item['playlist'].lower())
             self.plsmaxidx = len(self.playlists)-1
             self.index = 0
         except (ConnectionError, SocketError, SocketTimeout, IOError):
@@ -458,20 +561,28 @@ class MPDPlaylists:
         else:
             return 'no playlists'
 
-    def uppls(self):
+    def uppls(self, steps=1):
         if len(self.playlists) > 0:
-            self.index = self.index - 1 if self.index > 0 else self.plsmaxidx
+            self.index = step_index(self.index, -steps, len(self.playlists))
             return self.playlists[self.index]['playlist']
         else:
             return 'no playlists'
    
-    def downpls(self):
+    def downpls(self, steps=1):
         if len(self.playlists) > 0:
-            self.index = self.index + 1 if self.index < self.plsmaxidx else 0
+            self.index = step_index(self.index, steps, len(self.playlists))
             return self.playlists[self.index]['playlist']
         else:
             return 'no playlists'
     
+    def nextgroup(self):
+        if len(self.playlists) > 0:
+            self.index = self.playlists.letter_index().next(self.index)
+    
+    def prevgroup(self):
+        if len(self.playlists) > 0:
+            self.index = self.playlists.letter_index().prev(self.index)
+    
     def selectpls(self):
         if len(self.playlists) > 0:
             logging.info(
@@ -495,8 +606,9 @@ class MPDPlaylists:
             self.index = 0        
 
 class MPDdatabase:
-    def __init__(self, mpd_client):
+    def __init__(self, mpd_client, dir_cache=DIRCACHE):
         self.mpd_client = mpd_client
+        self.cache = dir_cache
         self.index = []
         self.listlen = 0
         self.path = []
@@ -504,21 +616,24 @@ class MPDdatabase:
     
     def refresh(self):
         try:
-            self.dirlist.append(self.mpd_client.lsinfo())
-##          Remove any playlist entries from the database lsinfo() call
-            for idx in range(len(self.dirlist[-1])):
-                if 'playlist' in self.dirlist[-1][idx]:
-                    break
-            del self.dirlist[-1][idx:len(self.dirlist[-1])]
+            # start again at the top, listings come from the cache
+            self.dirlist = [self.cache.listing(self.mpd_client, '')]
             self.listlen = len(self.dirlist[-1])
-            self.index.append(0)
-            self.path.append('')
+            self.index = [0]
+            self.path = ['']
+            self.prefetch()
         except (ConnectionError, SocketError, SocketTimeout, IOError):
             self.index = []
             self.listlen = 0
             self.path = []
             self.dirlist = []
     
+    def prefetch(self):
+##      fetch the highlighted directory in the background
+        entry = self.entry()
+        if 'directory' in entry:
+            self.cache.prefetch(self.mpd_client, entry['directory'])
+    
     def enter(self):
         try:
             entry = self.dirlist[-1][self.index[-1]]
@@ -526,9 +641,10 @@ class MPDdatabase:
                 self.path.append(entry['directory'])
                 logging.debug('entering ' + self.path[-1])
                 self.dirlist.append(
-                    self.mpd_client.lsinfo(self.path[-1]))
+                    self.cache.listing(self.mpd_client, self.path[-1]))
                 self.index.append(0)
                 self.listlen = len(self.dirlist[-1])
+                self.prefetch()
             else:
                 pass
         except (KeyError, IndexError, ConnectionError, SocketError, SocketTimeout, IOError):
@@ -550,15 +666,31 @@ class MPDdatabase:
         except (KeyError, IndexError, ConnectionError, SocketError, SocketTimeout, IOError):
             return {}
     
-    def upentry(self):
+    def upentry(self, steps=1):
+        try:
+            self.index[-1] = step_index(self.index[-1], -steps, self.listlen)
+            self.prefetch()
+        except (KeyError, IndexError, ZeroDivisionError, ConnectionError, SocketError, SocketTimeout, IOError):
+            pass
+    
+    def downentry(self, steps=1):
+        try:
+            self.index[-1] = step_index(self.index[-1], steps, self.listlen)
+            self.prefetch()
+        except (KeyError, IndexError, ZeroDivisionError, ConnectionError, SocketError, SocketTimeout, IOError):
+            pass
+    
+    def nextgroup(self):
         try:
-            self.index[-1] = self.index[-1] - 1 if self.index[-1] > 0 else self.listlen-1
+            self.index[-1] = self.dirlist[-1].letter_index().next(self.index[-1])
+            self.prefetch()
         except (KeyError, IndexError, ConnectionError, SocketError, SocketTimeout, IOError):
             pass
     
-    def downentry(self):
+    def prevgroup(self):
         try:
-            self.index[-1] = self.index[-1] + 1 if self.index[-1] < self.listlen-1 else 0
+            self.index[-1] = self.dirlist[-1].letter_index().prev(self.index[-1])
+            self.prefetch()
         except (KeyError, IndexError, ConnectionError, SocketError, SocketTimeout, IOError):
             pass
     
@@ -577,48 +709,78 @@ class MPDdatabase:
         except (KeyError, IndexError, ConnectionError, SocketError, SocketTimeout, IOError):
             pass
 
-MENUS = PreferenceMenu(config)
-MPD = LockableMPDClient() # for sending commands and getting status
-MPD2 = LockableMPDClient() # for idle updates only
-mpdcurrplaylist = MPDCurrentPlaylist(MPD)
-mpdplaylists = MPDPlaylists(MPD)
-mpdplaylist = MPDPlaylist(MPD)
+SCHEMA = PreferenceSchema() # providers and hooks named in [preferencemenu]
+SCHEMA.provider('mpd_servers', lambda: MpdPreferences().mpdnames())
+SCHEMA.provider('mpdnames', SCHEMA.providers['mpd_servers']) # older rc files
+SCHEMA.hook('reconnect_clients', lambda: reconnect_clients())
+PREFSTORE = PreferenceStore(config, '~/.mpdremoteprefs', # dyn prefs recorded here
+                            delay=config['staticpreferences'].getfloat(
+                                'prefs_save_delay', SAVE_DELAY))
+MENUS = PreferenceMenu(config, SCHEMA, PREFSTORE)
+POOL = MPDConnectionManager(config,
+                            timeout=config['staticpreferences'].getfloat(
+                                'mpd_timeout', TIMEOUT))
+MPD = POOL['command'] # for short commands and getting status
+MPDB = POOL['browse'] # for the menus, browsing and prefetching
+MPD2 = POOL['idle'] # for idle updates only
+POOL.listeners.append(PLAYQUEUE.invalidate) # their versions may be stale
+POOL.listeners.append(QUEUEINDEX.invalidate)
+mpdcurrplaylist = MPDCurrentPlaylist(MPDB)
+mpdplaylists = MPDPlaylists(MPDB)
+mpdplaylist = MPDPlaylist(MPDB)
 mpdstatus = MPDStatus(MPD)
-CAD = pifacecad.PiFaceCAD()
-updown = pifacecad.LCDBitmap([0x4,0xe,0x1f,0x0,0x0,0x1f,0xe,0x4])
-CAD.lcd.store_custom_bitmap(0, updown)
-updown = 0
-right = pifacecad.LCDBitmap([0x0,0x8,0xc,0xe,0xc,0x8,0x0,0x0])
-CAD.lcd.store_custom_bitmap(1, right)
-right = 1
-left = pifacecad.LCDBitmap([0x0,0x2,0x6,0xe,0x6,0x2,0x0,0x0])
-CAD.lcd.store_custom_bitmap(2, left)
-left = 2
-ok = pifacecad.LCDBitmap([0xc,0x12,0x12,0xc,0x0,0x5,0x6,0x5])
-CAD.lcd.store_custom_bitmap(3, ok)
-ok = 3
-retrn = pifacecad.LCDBitmap([0x0,0x0,0x1,0x12,0x14,0x18,0x1e,0x0])
-CAD.lcd.store_custom_bitmap(4, retrn)
-retrn = 4
-degF = pifacecad.LCDBitmap([0x1c,0x14,0x1c,0x7,0x4,0x6,0x4,0x4])
-CAD.lcd.store_custom_bitmap(5, degF)
-degF = 5
-mph1 = pifacecad.LCDBitmap([0x1a,0x15,0x15,0x0,0x1,0x2,0x0,0x0])
-CAD.lcd.store_custom_bitmap(6, mph1)
-mph1 = 6
-mph2 = pifacecad.LCDBitmap([0x0,0x4,0x8,0x14,0x4,0x6,0x5,0x5])
-CAD.lcd.store_custom_bitmap(7, mph2)
-mph2 = 7
-LM = LockableMarquee(CAD.lcd)
-LM.backlight_duration = config['preferences'].getfloat('backlight_duration')
+modestatus = MPDStatus(MPDB) # mode menus run with the menus on MPDB
+CAD = None # opened by init_display()
+LM = None
+# custom lcd bitmaps, stored by init_display()
+(updown, right, left, ok, retrn, degF, mph1, mph2) = range(8)
+BITMAPS = ([0x4,0xe,0x1f,0x0,0x0,0x1f,0xe,0x4],  # updown
+           [0x0,0x8,0xc,0xe,0xc,0x8,0x0,0x0],    # right
+           [0x0,0x2,0x6,0xe,0x6,0x2,0x0,0x0],    # left
+           [0xc,0x12,0x12,0xc,0x0,0x5,0x6,0x5],  # ok
+           [0x0,0x0,0x1,0x12,0x14,0x18,0x1e,0x0],# retrn
+           [0x1c,0x14,0x1c,0x7,0x4,0x6,0x4,0x4], # degF
+           [0x1a,0x15,0x15,0x0,0x1,0x2,0x0,0x0], # mph1
+           [0x0,0x4,0x8,0x14,0x4,0x6,0x5,0x5],   # mph2
+           )
+DISPLAY = DisplayQueue(config['staticpreferences'].getfloat('display_min_interval',
+                                                            MIN_INTERVAL))
+DISPATCHER = EventDispatcher() # runs the IR menu keys, repeats collapsed
+TRANSPORT = EventDispatcher(name='irtransport') # the keys served by MPD
+DIGIT_KEYS = tuple(str(digit)+'key' for digit in range(10))
+RUNTIME = None # the AsyncRuntime when run with --asyncio
+TIMERS = SCHEDULER # delayed calls, loop timers under the async runtime
+RETRY_POLL = 0.5 # seconds, shortest ping delay while reconnecting
+IDLE_TIMEOUT = 300.0 # seconds an idle wait lasts before MPD2 is checked
 stop_now = False
 pinger = None
+infoloop = None
 idlethread = None
 snoozetimer = None
-stationlist = eval(config['staticpreferences'].get('weather_stations','()'))
+stationlist = literal_eval(config['staticpreferences'].get('weather_stations','()'))
 stations = []
 for entry in stationlist:
     stations.append(WeatherStation(entry['location'], entry['id']))
+weather = WeatherFetcher(stations,
+                         config['staticpreferences'].getfloat('weather_max_age',
+                                                              MAX_AGE),
+                         config['staticpreferences'].getfloat('weather_timeout',
+                                                              FETCH_TIMEOUT))
+
+def init_display():
+##  the splash goes up first, the custom bitmaps are stored behind it
+    global CAD
+    global LM
+    CAD = pifacecad.PiFaceCAD()
+    CAD.lcd.blink_off()
+    CAD.lcd.cursor_off()
+    LM = LockableMarquee(CAD.lcd, TIMERS)
+    LM.backlight_duration = config['preferences'].getfloat('backlight_duration')
+    LM.marquee_start('mpdremote', 'starting...')
+    STARTUP.phase('splash')
+    for (index, bitmap) in enumerate(BITMAPS):
+        CAD.lcd.store_custom_bitmap(index, pifacecad.LCDBitmap(bitmap))
+    STARTUP.phase('bitmaps')
 
 class MPDdatabaseMenu(MPDdatabase):
     def __init__(self, mpd_client):
@@ -636,58 +798,319 @@ class MPDdatabaseMenu(MPDdatabase):
         else:
             return ['no connection',[retrn]]
 
-mpddatabase = MPDdatabaseMenu(MPD)
-
-def disconnect_clients():
-    try:
-        logging.debug('disconnect MPD')
-        MPD.disconnect()
-    except ConnectionError:
-        pass
-    try:
-        MPD2.noidle()
-    except (CommandError, ConnectionError):
-        pass
-    try:
-        logging.debug('disconnect MPD2')
-        MPD2.disconnect()
-    except (CommandError, ConnectionError):
-        pass
-    logging.debug('exit disconnect_clients()')
+mpddatabase = MPDdatabaseMenu(MPDB)
 
-def connect_client(mpc, label='MPD'):
-    mpdrec = MpdPreferences().preferredClient(config)
-    logging.info(label+' connecting to '+mpdrec['name'])
-    if mpdrec['host']:
+class MPDTagBrowser:
+    """Browses the database by artist, then album, then song."""
+    def __init__(self, mpd_client, tag_cache=TAGCACHE):
+        self.mpd_client = mpd_client
+        self.cache = tag_cache
+        self.path = []     # tag values chosen, one per level entered
+        self.index = []
+        self.listings = []
+    
+    def refresh(self):
         try:
-            mpc.connect(mpdrec['host'],
-                        mpdrec['port'])
-            logging.info(label+' connected to '+mpdrec['name'])
-            if LM.acquire(False):
-                logging.debug('have display lock, showing info')
-                LM.marquee_start(label+' connected')
-                logging.debug('releasing display lock')
-                LM.release()
-        except (ConnectionError, SocketError, SocketTimeout, IOError) as ex:
-            if str(ex) == "already connected":
-                pass
+            self.listings = [self.cache.listing(self.mpd_client, ())]
+            self.index = [0]
+            self.path = []
+            self.prefetch()
+        except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
+            self.index = []
+            self.path = []
+            self.listings = []
+    
+    def tags(self):
+        return len(self.path) < len(TAG_LEVELS) # not yet down to the songs
+    
+    def value(self):
+        try:
+            return self.listings[-1][self.index[-1]]
+        except (IndexError, KeyError):
+            return None
+    
+    def prefetch(self):
+##      fetch the highlighted artist or album in the background
+        value = self.value()
+        if self.tags() and value is not None:
+            self.cache.prefetch(self.mpd_client, tuple(self.path)+(value,))
+    
+    def enter(self):
+        value = self.value()
+        if not self.tags() or value is None:
+            return
+        try:
+            path = tuple(self.path)+(value,)
+            listing = self.cache.listing(self.mpd_client, path)
+            self.path.append(value)
+            self.listings.append(listing)
+            self.index.append(0)
+            self.prefetch()
+        except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
+            pass
+    
+    def back(self):
+        if len(self.listings) > 1:
+            self.listings.pop()
+            self.index.pop()
+            self.path.pop()
+    
+    def up(self, steps=1):
+        if self.listings and self.listings[-1]:
+            self.index[-1] = step_index(self.index[-1], -steps, len(self.listings[-1]))
+            self.prefetch()
+    
+    def down(self, steps=1):
+        if self.listings and self.listings[-1]:
+            self.index[-1] = step_index(self.index[-1], steps, len(self.listings[-1]))
+            self.prefetch()
+    
+    def nextgroup(self):
+        if self.listings and self.listings[-1]:
+            self.index[-1] = self.listings[-1].letter_index().next(self.index[-1])
+            self.prefetch()
+    
+    def prevgroup(self):
+        if self.listings and self.listings[-1]:
+            self.index[-1] = self.listings[-1].letter_index().prev(self.index[-1])
+            self.prefetch()
+    
+    def entry(self):
+        value = self.value()
+        menu = [retrn,left,updown] if self.path else [retrn,updown]
+        if value is None:
+            return ['no connection' if not self.listings else 'nothing here',
+                    [retrn]]
+        elif self.tags():
+            menu.extend([right,ok,'-add,2-play'])
+            return [value or '[no '+TAG_LEVELS[len(self.path)]+']', menu]
+        menu.extend([ok,'-add,2-play'])
+        return [MPDSongEntry(value).title(), menu]
+    
+    def select(self, playnow=False):
+        value = self.value()
+        if value is None:
+            return
+        try:
+            pos = MPDStatus(self.mpd_client).playqueuestats()[1]
+            if self.tags():
+                query = []
+                for (tag, chosen) in zip(TAG_LEVELS, self.path+[value]):
+                    query.extend([tag, chosen])
+                logging.info('Adding '+' '.join(query)+' to playqueue')
+                self.mpd_client.findadd(*query)
             else:
-                logging.warning(label+' connect failed: '+str(ex))
-                if LM.acquire(False):
-                    logging.debug('have display lock, showing info')
-                    LM.marquee_start(label+' connect failed', str(ex))
-                    logging.debug('releasing display lock')
-                    LM.release()
-    else: # the mpd server had gone off-line
-        logging.warning(label+' server '+mpdrec['name']+' is no longer available')
+                logging.info('Adding '+value['file']+' to playqueue')
+                self.mpd_client.add(value['file'])
+            if playnow: self.mpd_client.play(pos)
+        except (KeyError, CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
+            pass
+
+mpdtags = MPDTagBrowser(MPDB)
+
+class DigitEntry:
+    """Digits typed on the number keys, and the matches they find. A
+    subclass looks the digits up and acts on the highlighted match.
+    """
+    def __init__(self, mpd_client):
+        self.mpd_client = mpd_client
+        self.digits = ''
+        self.matches = []
+        self.index = 0
+        self.stale = False # digits typed since the last search
+    
+    def clear(self):
+        self.digits = ''
+        self.matches = []
+        self.index = 0
+        self.stale = False
+    
+    def digit(self, key):
+        # searched when shown, so quickly typed digits search once
+        self.digits += key[0]
+        self.stale = True
+    
+    def backspace(self):
+        if self.digits:
+            self.digits = self.digits[:-1]
+            self.stale = True
+    
+    def lookup(self, digits):
+        return []
+    
+    def search(self):
+        if self.stale:
+            self.matches = self.lookup(self.digits)
+            self.index = 0
+            self.stale = False
+        return self.matches
+    
+    def up(self, steps=1):
+        if self.search():
+            self.index = step_index(self.index, -steps, len(self.matches))
+    
+    def down(self, steps=1):
+        if self.search():
+            self.index = step_index(self.index, steps, len(self.matches))
+
+class LibrarySearch(DigitEntry):
+    def __init__(self, mpd_client, library):
+        super(LibrarySearch, self).__init__(mpd_client)
+        self.library = library
+    
+    def lookup(self, digits):
+        return self.library.search(digits)
+    
+    def entry(self):
+        matches = self.search()
+        menu = [retrn,left,updown,ok,right,' '+self.digits[-6:]]
+        if not self.library.ready():
+            return ['indexing library' if self.library.updating
+                    else 'no library index', [retrn]]
+        elif not self.digits:
+            return ['type 2-9 to search', [retrn,' '+self.digits]]
+        elif not matches:
+            return ['no match', menu]
+        match = matches[self.index]
+        if match.kind == 'title':
+            return [match.label, menu]
+        return [match.kind.capitalize()+': '+match.label, menu]
+    
+    def select(self, playnow=False):
+        try:
+            matches = self.search()
+            if matches:
+                match = matches[self.index]
+                pos = MPDStatus(self.mpd_client).playqueuestats()[1]
+                logging.info('Adding '+match.kind+' '+match.label+' to playqueue')
+                self.mpd_client.findadd(*match.query)
+                if playnow: self.mpd_client.play(pos)
+        except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
+            pass
+
+LIBRARY = LibraryIndex(config['staticpreferences'].get('library_index', INDEX_PATH))
+librarysearch = LibrarySearch(MPDB, LIBRARY)
+
+class QueueJump(DigitEntry):
+    """Jumps to a play queue song by the T9 digits of its title, or by its
+    number. right switches between the two.
+    """
+    def __init__(self, mpd_client, queue_index=QUEUEINDEX, queue_cache=PLAYQUEUE):
+        super(QueueJump, self).__init__(mpd_client)
+        self.queueindex = queue_index
+        self.queue = queue_cache
+        self.bynumber = False
+    
+    def start(self):
+        self.clear()
+        try:
+            self.queue.sync(self.mpd_client)
+        except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
+            self.queue.invalidate()
+        # a long queue takes a while to index: numbers work meanwhile
+        self.queueindex.start_build(self.mpd_client)
+    
+    def toggle(self):
+        self.bynumber = not self.bynumber
+        self.clear()
+    
+    def lookup(self, digits):
+        # a song number is not searched, it is the position
+        return [] if self.bynumber else self.queueindex.search(digits)
+    
+    def search(self):
+        # digits typed while indexing are searched once the index is built
+        if not self.bynumber and not self.queueindex.ready():
+            return []
+        return super(QueueJump, self).search()
+    
+    def position(self):
+        if self.bynumber:
+            if not self.digits or not self.queue.length:
+                return None
+            return min(max(int(self.digits), 1), self.queue.length) - 1
+        matches = self.search()
+        return matches[self.index] if matches else None
+    
+    def entry(self):
+        menu = [retrn,left,updown,ok,right,
+                (' #' if self.bynumber else ' ')+self.digits[-6:]]
+        pos = self.position()
+        if not self.queue.length:
+            return ['no play queue', [retrn]]
+        elif not self.bynumber and not self.queueindex.ready():
+            return ['indexing titles' if self.queueindex.building
+                    else 'no title index', menu]
+        elif pos is not None:
+            song = MPDSongEntry(self.queue.entry(self.mpd_client, pos))
+            return [str(pos+1)+' '+song.title(), menu]
+        elif not self.digits:
+            return ['type song number' if self.bynumber
+                    else 'type title 2-9', menu]
+        return ['no match', menu]
+    
+    def moveto(self, playlist):
+        pos = self.position()
+        if pos is not None:
+            playlist.index = pos
+    
+    def select(self):
+        pos = self.position()
+        if pos is not None:
+            logging.info('Jumping to song '+str(pos+1)+' of the playqueue')
+            self.mpd_client.play(str(pos))
+
+queuejump = QueueJump(MPDB)
+
+def update_library():
+    # checked on a connection of its own, the listing can take a while
+    LIBRARY.start_update(lambda: POOL.open_client('library'))
+
+def disconnect_clients():
+    POOL.disconnect_all()
+    logging.debug('exit disconnect_clients()')
 
 def connect_clients():
-    connect_client(MPD, 'MPD')
-    connect_client(MPD2, 'MPD2')
+    POOL.connect_all()
 
 def reconnect_clients():
-    disconnect_clients()
-    connect_clients()
+    # a preference hook, called by a menu handler holding MPDB: the switch
+    # waits for the role locks on the pool worker instead
+    POOL.post(switch_server)
+
+def switch_server():
+    DIRCACHE.invalidate() # listings of the old server's database
+    TAGCACHE.invalidate()
+    PLAYQUEUE.invalidate()
+    QUEUEINDEX.invalidate()
+    POOL.reconnect_all()
+    update_library() # another server has another library
+
+def stats():
+    # the counters kept by the caches, the display and the connections, to
+    # see how much work each saved; logged at power off, read by the bench
+    return {'scheduler': TIMERS.stats(),
+            'keys': {'received': DISPATCHER.received + TRANSPORT.received,
+                     'dispatched': DISPATCHER.dispatched + TRANSPORT.dispatched},
+            'display': {'posted': DISPLAY.posted, 'rendered': DISPLAY.rendered},
+            'lcd': {'frames': LM.frames, 'cell_writes': LM.cell_writes,
+                    'backlight_ons': LM.backlight_ons,
+                    'backlight_offs': LM.backlight_offs},
+            'mpd': {'connects': POOL.connects, 'failovers': POOL.failovers},
+            'reconnect': {'recoveries': POOL.reconnect.recoveries,
+                          'recovery_max': POOL.reconnect.recovery_max},
+            'playqueue': {'fetches': PLAYQUEUE.fetches, 'deltas': PLAYQUEUE.deltas},
+            'queueindex': {'builds': QUEUEINDEX.builds,
+                           'deltas': QUEUEINDEX.deltas},
+            'dircache': {'fetches': DIRCACHE.fetches, 'hits': DIRCACHE.hits,
+                         'misses': DIRCACHE.misses},
+            'tagcache': {'fetches': TAGCACHE.fetches, 'hits': TAGCACHE.hits,
+                         'misses': TAGCACHE.misses},
+            'library': {'builds': LIBRARY.builds},
+            'discovery': {'browses': DISCOVERY.browses},
+            'preferences': {'writes': PREFSTORE.writes},
+            'weather': {'failing': len(weather.errors)}, # stations, last fetch failed
+            }
 
 def cancel_timers():
     global infoloop
@@ -701,8 +1124,13 @@ def cancel_timers():
     if snoozetimer:
         logging.info('canceling snooze timer')
         snoozetimer.cancel()
+    weather.stop()
+    DISPLAY.stop()
+    DISPATCHER.stop() # keys pressed after power are dropped
+    TRANSPORT.stop()
     LM.cancel_timers()
     logging.info('canceled marquee timers')
+    logging.info('stats: '+str(stats()))
 
 def power_off(event):
     global stop_now
@@ -710,115 +1138,145 @@ def power_off(event):
 ##    print(event.ir_code)
     stop_now = True
     cancel_timers()
-    try:
-        logging.info('canceling idleloop')
-        MPD2.noidle()
-    except (CommandError, ConnectionError, SocketError, SocketTimeout, IOError):
-        pass
-    end_barrier.wait()
+    PREFSTORE.close() # a pending preference change is written now
+    logging.info('canceling idleloop')
+    POOL.interrupt(MPD2) # a noidle would race the idle loop's read
+    POOL.reconnect.wake() # ends a reconnect wait of the idle loop
+    if RUNTIME:
+        RUNTIME.stop()
+    else:
+        end_barrier.wait()
+
+def show_if_free(text, text2=None):
+    if LM.acquire(False): # display only if LM not locked
+        LM.marquee_start(text, text2)
+        LM.release()
+
+def check_connections():
+    # health check of the command connections and the warm spares. Pings
+    # and reconnects block, so they run on the pool worker: the scheduler
+    # thread or the event loop only posts the check
+    POOL.post(POOL.check)
 
 def ping():
     global stop_now
     global pinger
     if not stop_now:
-        with MPD:
-            try:
-                MPD.ping()
-            except SocketTimeout as to:
-                logging.warning('MPD timeout, disconnecting')
-                logging.info(
-                    'MPD will try again in '+
-                    config['staticpreferences'].get('ping_interval','59.0')+
-                    ' secs')
-                MPD.disconnect()
-                with LM:
-                    LM.marquee_start('MPD reconnecting', str(to))
-            except (ConnectionError, SocketError, IOError):
-                logging.info('Need to establish connection for MPD')
-                mpdrec = MpdPreferences().preferredClient(config)
-                if mpdrec['host']:
-                    try:
-                        MPD.connect(mpdrec['host'],
-                                    mpdrec['port'])
-                        logging.info('MPD connected to '+mpdrec['name'])
-                        with LM:
-                            LM.marquee_start('MPD connected')
-                    except ConnectionError as err:
-                        if str(err) == "already connected":
-                            MPD.disconnect()
-                        logging.warning('MPD connect failed: '+str(err))
-                        logging.info(
-                            'MPD will try again in '+
-                            config['staticpreferences'].get('ping_interval','59.0')+
-                            ' secs')
-                        with LM:
-                            LM.marquee_start('MPD connect failed', str(ex))
-                    except (SocketError, SocketTimeout, IOError) as ex:
-                        logging.warning('MPD connect failed: '+str(ex))
-                        logging.info(
-                            'MPD will try again in '+
-                            config['staticpreferences'].get('ping_interval','59.0')+
-                            ' secs')
-                        with LM:
-                            LM.marquee_start('MPD connect failed', str(ex))
-                else: # the mpd server had gone off-line
-                    logging.warning('MPD server '+mpdrec['name']+' is no longer available')
-                    logging.info(
-                        'MPD will try again in '+
-                        config['staticpreferences'].get('ping_interval','59.0')+
-                        ' secs')
-        pinger = threading.Timer(float(config['staticpreferences'].
-                                 get('ping_interval','59.0')),
-                                 ping)
-        pinger.start()
+        check_connections()
+        pinger = TIMERS.call_later(ping_delay(), ping)
     else:
         logging.debug('stopping MPD pinger')
         pinger = None
 
+def ping_interval():
+    return float(config['staticpreferences'].get('ping_interval','59.0'))
+
+def ping_delay():
+    # a broken connection is retried as soon as the backoff allows
+    if POOL.healthy:
+        return ping_interval()
+    return min(ping_interval(), max(POOL.reconnect.remaining(), RETRY_POLL))
+
+def reconnect_now():
+    # avahi found a change or the backoff was cut short: check right away
+    if not stop_now:
+        check_connections()
+
 infoloopcount = 0
-def infolooper():
-    global stop_now
-    global infoloop
+def show_info():
     global infoloopcount
     infoloopcount += 1
     logging.debug('infoloopcount = '+str(infoloopcount))
-    if not stop_now:
-        if LM.acquire(False):
-            logging.debug('have display lock, showing info')
-            display_type = config['preferences'].get('display_info')
-            if display_type == 'Time' or (display_type == 'Alternate' and infoloopcount % 2):
-                logging.debug('showing time')
-                LM.marquee_start(strftime(config['staticpreferences'].
-                                          get('ping_timeformat1',"%I:%M %p"),
-                                          localtime()),
-                                 strftime(config['staticpreferences'].
-                                          get('ping_timeformat2',"%a %b %d %Y"),
-                                          localtime()))
-            elif display_type == 'Weather' or (display_type == 'Alternate' and (infoloopcount+1) % 2):
-                loopcount = int(infoloopcount/2) if display_type == 'Alternate' else infoloopcount
-                stn_idx = loopcount % len(stations)
-                logging.debug('showing weather station: '+str(stn_idx))
-                station = stations[stn_idx]
-                try:
-                    station.generate_xmltree()
+    if LM.acquire(False):
+        logging.debug('have display lock, showing info')
+        display_type = config['preferences'].get('display_info')
+        if display_type == 'Time' or (display_type == 'Alternate' and infoloopcount % 2):
+            logging.debug('showing time')
+            LM.marquee_start(strftime(config['staticpreferences'].
+                                      get('ping_timeformat1',"%I:%M %p"),
+                                      localtime()),
+                             strftime(config['staticpreferences'].
+                                      get('ping_timeformat2',"%a %b %d %Y"),
+                                      localtime()))
+        elif display_type == 'Weather' or (display_type == 'Alternate' and (infoloopcount+1) % 2):
+            loopcount = int(infoloopcount/2) if display_type == 'Alternate' else infoloopcount
+            stn_idx = loopcount % len(stations)
+            logging.debug('showing weather station: '+str(stn_idx))
+            station = stations[stn_idx]
+            try: # only cached conditions, the fetch runs in the background
+                if weather.cached(station):
                     LM.marquee_start(station.location,
                                      [station.temperaturef,degF,' ',
                                       station.wind_dir,
                                       station.wind_mph,mph1,mph2])
-                except Exception as err:
-                    logging.error(station.location+': '+station.weather_id+': '+str(err))
-            logging.debug('releasing display lock')
-            LM.release()
-        else:
-            logging.debug('cannot get display lock; skipping info')
-        infoloop = threading.Timer(float(config['preferences'].
-                                 getfloat('info_interval')),
-                                 infolooper)
-        infoloop.start()
+                else:
+                    LM.marquee_start(station.location, 'no weather yet')
+            except Exception as err:
+                logging.error(station.location+': '+station.weather_id+': '+str(err))
+        logging.debug('releasing display lock')
+        LM.release()
+    else:
+        logging.debug('cannot get display lock; skipping info')
+
+def infolooper():
+    global stop_now
+    global infoloop
+    if not stop_now:
+        show_info()
+        infoloop = TIMERS.call_later(info_interval(), infolooper)
     else:
         logging.debug('stopping infolooper')
         infoloop = None
 
+def info_interval():
+    return float(config['preferences'].getfloat('info_interval'))
+
+## idle event displays, drawn by the DISPLAY queue renderer thread.
+## each makes a single MPDSnapshot round trip (plus the playlist delta),
+## publishes it to NOWPLAYING and only then waits for the display
+def render_nowplaying(draw):
+    with MPD:
+        snapshot = MPDSnapshot(MPD).fetch()
+    NOWPLAYING.publish(snapshot)
+    with LM:
+        # a menu may have held the display meanwhile: a change since the
+        # fetch has posted a newer request, which draws instead
+        if DISPLAY.pending():
+            logging.debug('display request outdated, skipped')
+            return
+        draw(snapshot, snapshot.songentry())
+
+def show_playlist():
+    render_nowplaying(lambda snapshot, song:
+                      LM.marquee(song.title_album()))
+
+def show_mixer():
+    render_nowplaying(lambda snapshot, song:
+                      LM.marquee_start(song.title(), snapshot.volume()))
+
+def show_player():
+    render_nowplaying(lambda snapshot, song:
+                      LM.marquee_start(song.title(), snapshot.playerstate()))
+
+def process_idle_event(event):
+    if 'playlist' in event:
+        logging.debug('process '+str(event))
+        DISPLAY.post(show_playlist)
+        QUEUEINDEX.start_sync(MPDB)
+    elif 'mixer' in event:
+        logging.debug('process '+str(event))
+        DISPLAY.post(show_mixer)
+    elif 'player' in event:
+        logging.debug('process '+str(event))
+        DISPLAY.post(show_player)
+    elif 'database' in event or 'update' in event:
+        logging.debug('process '+str(event))
+        DIRCACHE.invalidate()
+        TAGCACHE.invalidate()
+        update_library()
+    else:
+        logging.debug('ignored event: '+str(event))
+
 def idleloop():
     global stop_now
     firstpass = True
@@ -830,16 +1288,14 @@ def idleloop():
                 with MPD2:
                     if firstpass:
                         with LM:
-                            MPD2.ping()
-                            LM.marquee(MPDCurrentPlaylist(MPD2).
-                                             updatelist().
-                                             songentry().
-                                             title_album())
+                            snapshot = MPDSnapshot(MPD2).fetch()
+                            NOWPLAYING.publish(snapshot)
+                            LM.marquee(snapshot.songentry().title_album())
                         firstpass = False
 ##                    event = MPD2.idle()
                     MPD2.send_idle()
                     # wait for event with 5 minute timeout
-                    canRead = select([MPD2], [], [], 300.0)[0]
+                    canRead = select([MPD2], [], [], IDLE_TIMEOUT)[0]
                     logging.debug(str(canRead))
                     if canRead:
                         logging.debug('retrieving idle event')
@@ -851,81 +1307,72 @@ def idleloop():
                         except (CommandError, ConnectionError):
                             logging.debug('exception on noidle')
                             pass
-                if 'playlist' in event:
-                    logging.debug('process '+str(event))
-                    with MPD2, LM:
-                        LM.marquee(MPDCurrentPlaylist(MPD2).
-                                   updatelist().
-                                   songentry().
-                                   title_album())
-                        logging.debug('end processing playlist')
-                elif 'mixer' in event:
-                    logging.debug('process '+str(event))
-                    with MPD2, LM:
-                        volumestr = MPDStatus(MPD2).volume()
-                        LM.marquee_start(MPDCurrentPlaylist(MPD2).
-                                         updatelist().song(),
-                                         volumestr)
-                        logging.debug('end processing mixer')
-                elif 'player' in event:
-                    logging.debug('process '+str(event))
-                    with MPD2, LM:
-                        status = MPDStatus(MPD2)
-                        timestat = status.time()
-                        state = status.status['state']
-                        LM.marquee_start(MPDCurrentPlaylist(MPD2).
-                                         updatelist().song(),
-                                         state+' at '+timestat)
-                        logging.debug('end processing player')
-                else:
-                    logging.debug('ignored event: '+str(event))
-            except (PendingCommandError, SocketTimeout, SocketError) as to:
-                if not stop_now:
-                    logging.warning(str(to)+': MPD2 problem, disconnecting: '+str(to))
-                with MPD2, LM:
-                    try:
-                        MPD2.disconnect()
-                    except ConnectionError: # if already disconnect, ignore exception
-                        pass
-                    if not stop_now:
-                        LM.marquee_start('MPD2 reconnecting', str(to))
-            except (ConnectionError, IOError) as exp:
-                logging.info(str(exp)+': Need to establish connection for MPD2')
-                if str(exp) == "Connection lost while reading line":
-                    logging.debug('MPD2 idle lost connection during read')
-                    logging.info('MPD2 will try again in 60 secs')
-                    time.sleep(60)
+                process_idle_event(event)
+            except (PendingCommandError, ConnectionError, SocketTimeout,
+                    SocketError, IOError) as err:
+                if stop_now:
+                    break
+                logging.warning(str(err)+': MPD2 problem, reconnecting')
+                show_if_free('MPD2 reconnecting', str(err))
+                with MPD2:
+                    connected = POOL.failover(MPD2)
+                if connected:
+                    firstpass = True
                 else:
-                    mpdrec = MpdPreferences().preferredClient(config)
-                    if mpdrec['host']:
-                        try:
-                            with MPD2:
-                                MPD2.connect(mpdrec['host'],
-                                             mpdrec['port'])
-                            logging.info('MPD2 connected to '+mpdrec['name'])
-                        except ConnectionError as err:
-                            if str(err) == "already connected":
-                                MPD2.disconnect()
-                            logging.warning('MPD2 connect failed: '+str(err))
-                            logging.info('MPD2 will try again')
-                            with LM:
-                                LM.marquee_start('MPD2 connect failed', str(err))
-                        except (SocketError, SocketTimeout, IOError) as ex:
-                            logging.warning('MPD2 connect failed: '+str(ex))
-                            logging.info('MPD2 will try again in 60 secs')
-                            with LM:
-                                LM.marquee_start('MPD2 connect failed', str(ex))
-                            time.sleep(60)
-                    else: # the mpd server had gone off-line
-                        logging.warning('MPD2 server '+mpdrec['name']+' is no longer available')
-                        logging.info('MPD2 will try again in 60 secs')
-                        time.sleep(60)
+                    logging.info('MPD2 will try again in '+
+                                 '{:.1f}'.format(POOL.reconnect.remaining())+' secs')
+                    POOL.reconnect.wait() # woken early by power_off or avahi
             event = {}
             logging.debug('MPD2 idle loop bottom')
         logging.info('MPD2 idleloop terminating')
     else:
         logging.info('stopping MPD2 idleloop')
 
+async def async_idleloop():
+##  idleloop() as an asyncio task: waits on the MPD2 socket with the loop
+##  instead of a select() thread, so no timeout is needed to notice stop_now
+    global stop_now
+    loop = RUNTIME.loop
+    while not MPD2.acquire(False): # connect_all() holds it only briefly
+        await asyncio.sleep(LOCK_POLL)
+    try:
+        firstpass = True
+        logging.debug('begin MPD2 idle task')
+        while not stop_now:
+            try:
+                if firstpass:
+                    DISPLAY.post(show_playlist)
+                    firstpass = False
+                MPD2.send_idle()
+                try:
+                    await asyncio.wait_for(wait_readable(loop, MPD2.fileno()),
+                                           IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # check the connection: a noidle left unanswered times
+                    # out and fails over
+                    logging.debug('idle timeout: send noidle')
+                    process_idle_event(
+                        await loop.run_in_executor(None, MPD2.noidle))
+                    continue
+                logging.debug('retrieving idle event')
+                process_idle_event(MPD2.fetch_idle())
+            except (PendingCommandError, ConnectionError, SocketTimeout,
+                    SocketError, IOError) as err:
+                if stop_now:
+                    break
+                logging.warning(str(err)+': MPD2 problem, reconnecting')
+                show_if_free('MPD2 reconnecting', str(err))
+                # the connect blocks, it runs on an executor thread
+                if await loop.run_in_executor(None, POOL.failover, MPD2):
+                    firstpass = True
+                else:
+                    logging.info('MPD2 will try again in '+
+                                 '{:.1f}'.format(POOL.reconnect.remaining())+' secs')
+                    await POOL.reconnect.wait_async()
+        logging.info('MPD2 idle task terminating')
+    finally:
+        MPD2.release()
+
 def play(event):
     with MPD:
         try:
@@ -957,8 +1404,7 @@ def wakeup():
         try:
             MPD.play() # player change display handled by idleloop
         except (ConnectionError, SocketError, SocketTimeout, IOError):
-            with LM:
-                LM.marquee_start('not connected')
+            show_if_free('not connected')
 
 def snooze(event):
     global snoozetimer
@@ -968,12 +1414,29 @@ def snooze(event):
         except (ConnectionError, SocketError, SocketTimeout, IOError):
             with LM:
                 LM.marquee_start('not connected')
-    snoozetimer = threading.Timer(float(config['preferences'].
-                             getfloat('snooze_interval'))*60.0,
-                             wakeup)
-    snoozetimer.start()
+    # wakeup waits for the command connection, off the scheduler thread
+    snoozetimer = TIMERS.call_later(float(config['preferences'].
+                                    getfloat('snooze_interval'))*60.0,
+                                    POOL.post, wakeup)
+
+def show_nowplaying():
+##  renders from NOWPLAYING, no mpd round trip
+    snapshot = NOWPLAYING.snapshot
+    if snapshot and snapshot.song:
+        song = MPDSongEntry(snapshot.song)
+        logging.debug(str(song.entry))
+        line2 = NOWPLAYING.elapsed()
+        line2 = line2 + ' vol: ' + snapshot.status.get('volume', '')+'%'
+##        line2 = line2 + ' ' + song.album()
+        line2 = line2 + ' ' + song.artist()
+        show_if_free(song.title(), line2)
+    else:
+        show_if_free('no play list')
 
 def current_pl (event):
+    if event.ir_code == 'disp':
+        show_nowplaying()
+        return
     with MPD:
         try:
             status = MPD.status()
@@ -981,16 +1444,6 @@ def current_pl (event):
                 MPD.next() # player change display handled by idleloop
             elif event.ir_code == 'prev':
                 MPD.previous() # player change display handled by idleloop
-            elif event.ir_code == 'disp' and 'songid' in status:
-                song = MPDSongEntry(MPD.playlistid(status['songid'])[0])
-                logging.debug(str(song.entry))
-                line2 = status['time'] if 'time' in status else ' '
-                line2 = line2 + ' vol: ' + status['volume']+'%'
-##                line2 = line2 + ' ' + song.album()
-                line2 = line2 + ' ' + song.artist()
-                if LM.acquire(False): # display only if LM not locked
-                    LM.marquee_start(song.title(), line2)
-                    LM.release()
             else:
                 if LM.acquire(False): # display only if LM not locked
                     LM.marquee_start('no play list')
@@ -1004,6 +1457,9 @@ def main():
     global listener
     global idlethread
     global end_barrier
+    global RUNTIME
+    global TIMERS
+    global DISPLAY
     parser = argparse.ArgumentParser(description='piface IR remote handler for mpd')
     parser.add_argument('-d', '--daemon',
                         action='store_true',
@@ -1011,6 +1467,9 @@ def main():
     parser.add_argument('-v', '--verbose',
                         action='count',
                         help='increase log verbosity -v, -vv')
+    parser.add_argument('--asyncio',
+                        action='store_true',
+                        help='run the idle loop, timers and display on one asyncio event loop')
     args = parser.parse_args()
     log_level = config['staticpreferences'].get('log_level','WARNING')
     if args.verbose:
@@ -1034,6 +1493,20 @@ def main():
         for key2 in config[key]:
             logging.debug('    '+key2+" = "+config[key][key2])
 
+    STARTUP.phase('load')
+    DISCOVERY.ttl = config['staticpreferences'].getfloat('discovery_ttl',
+                                                         DISCOVERY_TTL)
+    DISCOVERY.start_refresh() # avahi runs while the display starts
+    if args.asyncio:
+        RUNTIME = AsyncRuntime()
+        TIMERS = RUNTIME.scheduler
+    connecting = Thread(target=POOL.connect_all, name='connect')
+    connecting.daemon = True
+    connecting.start() # the roles connect in parallel, behind the splash
+    init_display()
+    if RUNTIME:
+        DISPLAY = AsyncDisplayQueue(RUNTIME.loop, LM, DISPLAY.min_interval)
+
     end_barrier = Barrier(2)
 ##  FSM for menu functions
     FSM = Fsm()
@@ -1074,17 +1547,21 @@ def main():
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
                       LM.marquee_start(mpdcurrplaylist.song(),
-                                       [left,updown,ok,'-play 2-remove']),
+                                       [left,updown,right,ok,'-play 2-del']),
                       ])
                   .add_eventhandler('return', 'playqueue')
                   .add_eventhandler('left', 'playqueue')
+                  .add_eventhandler('right', 'queuejump',[
+                      lambda ev, prev, nxt:
+                      queuejump.start(),
+                      ])
                   .add_eventhandler('up', 'songselect',[
                       lambda ev, prev, nxt:
-                      mpdcurrplaylist.upsong(),
+                      mpdcurrplaylist.upsong(DISPATCHER.step()),
                       ])
                   .add_eventhandler('down', 'songselect',[
                       lambda ev, prev, nxt:
-                      mpdcurrplaylist.downsong(),
+                      mpdcurrplaylist.downsong(DISPATCHER.step()),
                       ])
                   .add_eventhandler('select', 'idle',[
                       lambda ev, prev, nxt:
@@ -1098,6 +1575,41 @@ def main():
                       lambda ev, prev, nxt:
                       mpdcurrplaylist.deletesong(),
                       ]))
+    jump = (State('queuejump', 'Jump to Song')
+                  .add_enterhandlers([
+                      lambda ev, prev, nxt:
+                      LM.marquee(queuejump.entry()),
+                      ])
+                  .add_eventhandler('return', 'songselect',[
+                      lambda ev, prev, nxt:
+                      queuejump.moveto(mpdcurrplaylist),
+                      ])
+                  .add_eventhandler('left', 'queuejump',[
+                      lambda ev, prev, nxt:
+                      queuejump.backspace(),
+                      ])
+                  .add_eventhandler('right', 'queuejump',[
+                      lambda ev, prev, nxt:
+                      queuejump.toggle(),
+                      ])
+                  .add_eventhandler('up', 'queuejump',[
+                      lambda ev, prev, nxt:
+                      queuejump.up(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('down', 'queuejump',[
+                      lambda ev, prev, nxt:
+                      queuejump.down(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('select', 'idle',[
+                      lambda ev, prev, nxt:
+                      queuejump.select(),
+                      ]))
+    for digit in DIGIT_KEYS: # the number keys type T9 digits or the number
+        jump.add_eventhandler(digit, 'queuejump',[
+            lambda ev, prev, nxt:
+            queuejump.digit(ev),
+            ])
+    FSM.add_state(jump)
     FSM.add_state(State('playlists', 'Play Lists')
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
@@ -1120,11 +1632,19 @@ def main():
                   .add_eventhandler('left', 'playlists')
                   .add_eventhandler('up', 'plsselect',[
                       lambda ev, prev, nxt:
-                      mpdplaylists.uppls(),
+                      mpdplaylists.uppls(DISPATCHER.step()),
                       ])
                   .add_eventhandler('down', 'plsselect',[
                       lambda ev, prev, nxt:
-                      mpdplaylists.downpls(),
+                      mpdplaylists.downpls(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('nextgroup', 'plsselect',[
+                      lambda ev, prev, nxt:
+                      mpdplaylists.nextgroup(),
+                      ])
+                  .add_eventhandler('prevgroup', 'plsselect',[
+                      lambda ev, prev, nxt:
+                      mpdplaylists.prevgroup(),
                       ])
                   .add_eventhandler('right', 'playlistview',[
                       lambda ev, prev, nxt:
@@ -1150,11 +1670,19 @@ def main():
                       ])
                   .add_eventhandler('up', 'playlistview',[
                       lambda ev, prev, nxt:
-                      mpdplaylist.uptitle(),
+                      mpdplaylist.uptitle(DISPATCHER.step()),
                       ])
                   .add_eventhandler('down', 'playlistview',[
                       lambda ev, prev, nxt:
-                      mpdplaylist.downtitle(),
+                      mpdplaylist.downtitle(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('nextgroup', 'playlistview',[
+                      lambda ev, prev, nxt:
+                      mpdplaylist.nextgroup(),
+                      ])
+                  .add_eventhandler('prevgroup', 'playlistview',[
+                      lambda ev, prev, nxt:
+                      mpdplaylist.prevgroup(),
                       ])
                   .add_eventhandler('return', 'plsselect')
                   .add_eventhandler('left', 'plsselect')
@@ -1178,7 +1706,7 @@ def main():
                   .add_eventhandler('return', 'idle')
                   .add_eventhandler('left', 'idle')
                   .add_eventhandler('up', 'playlists')
-                  .add_eventhandler('down', 'modemenus')
+                  .add_eventhandler('down', 'tags')
                   .add_eventhandler('right', 'DBbrowse', [
                       lambda ev, prev, nxt:
                       mpddatabase.refresh(),
@@ -1195,11 +1723,19 @@ def main():
                       ])
                   .add_eventhandler('up', 'DBbrowse',[
                       lambda ev, prev, nxt:
-                      mpddatabase.upentry(),
+                      mpddatabase.upentry(DISPATCHER.step()),
                       ])
                   .add_eventhandler('down', 'DBbrowse',[
                       lambda ev, prev, nxt:
-                      mpddatabase.downentry(),
+                      mpddatabase.downentry(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('nextgroup', 'DBbrowse',[
+                      lambda ev, prev, nxt:
+                      mpddatabase.nextgroup(),
+                      ])
+                  .add_eventhandler('prevgroup', 'DBbrowse',[
+                      lambda ev, prev, nxt:
+                      mpddatabase.prevgroup(),
                       ])
                   .add_eventhandler('right', 'DBbrowse', [
                       lambda ev, prev, nxt:
@@ -1217,62 +1753,160 @@ def main():
                       lambda ev, prev, nxt:
                       mpddatabase.select(True),
                       ]))
+    FSM.add_state(State('tags', 'Artist Menu')
+                  .add_enterhandlers([
+                      lambda ev, prev, nxt: LM.marquee_start('Artists>',
+                                                          [left,updown,right]),])
+                  .add_eventhandler('return', 'idle')
+                  .add_eventhandler('left', 'idle')
+                  .add_eventhandler('up', 'database')
+                  .add_eventhandler('down', 'search')
+                  .add_eventhandler('right', 'TAGbrowse', [
+                      lambda ev, prev, nxt:
+                      mpdtags.refresh(),
+                      ]))
+    FSM.add_state(State('TAGbrowse', 'Browse by Artist')
+                  .add_enterhandlers([
+                      lambda ev, prev, nxt:
+                      LM.marquee(mpdtags.entry()),
+                      ])
+                  .add_eventhandler('return', 'tags')
+                  .add_eventhandler('left', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.back(),
+                      ])
+                  .add_eventhandler('up', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.up(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('down', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.down(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('nextgroup', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.nextgroup(),
+                      ])
+                  .add_eventhandler('prevgroup', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.prevgroup(),
+                      ])
+                  .add_eventhandler('right', 'TAGbrowse', [
+                      lambda ev, prev, nxt:
+                      mpdtags.enter(),
+                      ])
+                  .add_eventhandler('select', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.select(),
+                      ])
+                  .add_eventhandler('1key', 'TAGbrowse',[
+                      lambda ev, prev, nxt:
+                      mpdtags.select(),
+                      ])
+                  .add_eventhandler('2key', 'idle',[
+                      lambda ev, prev, nxt:
+                      mpdtags.select(True),
+                      ]))
+    FSM.add_state(State('search', 'Search Menu')
+                  .add_enterhandlers([
+                      lambda ev, prev, nxt: LM.marquee_start('Search>',
+                                                          [left,updown,right]),])
+                  .add_eventhandler('return', 'idle')
+                  .add_eventhandler('left', 'idle')
+                  .add_eventhandler('up', 'tags')
+                  .add_eventhandler('down', 'modemenus')
+                  .add_eventhandler('right', 'searchkeys', [
+                      lambda ev, prev, nxt:
+                      librarysearch.clear(),
+                      ]))
+    searchkeys = (State('searchkeys', 'Search Library')
+                  .add_enterhandlers([
+                      lambda ev, prev, nxt:
+                      LM.marquee(librarysearch.entry()),
+                      ])
+                  .add_eventhandler('return', 'search')
+                  .add_eventhandler('left', 'searchkeys',[
+                      lambda ev, prev, nxt:
+                      librarysearch.backspace(),
+                      ])
+                  .add_eventhandler('up', 'searchkeys',[
+                      lambda ev, prev, nxt:
+                      librarysearch.up(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('down', 'searchkeys',[
+                      lambda ev, prev, nxt:
+                      librarysearch.down(DISPATCHER.step()),
+                      ])
+                  .add_eventhandler('select', 'searchkeys',[
+                      lambda ev, prev, nxt:
+                      librarysearch.select(),
+                      ])
+                  .add_eventhandler('right', 'idle',[
+                      lambda ev, prev, nxt:
+                      librarysearch.select(True),
+                      ]))
+    for digit in DIGIT_KEYS: # the number keys type T9 digits
+        searchkeys.add_eventhandler(digit, 'searchkeys',[
+            lambda ev, prev, nxt:
+            librarysearch.digit(ev),
+            ])
+    FSM.add_state(searchkeys)
     FSM.add_state(State('modemenus', 'Mode Menu')
                   .add_enterhandlers([
                       lambda ev,prev, nxt:
                       LM.marquee_start('Mode Menus>', [left,updown,right]),])
                   .add_eventhandler('return', 'idle')
                   .add_eventhandler('left', 'idle')
-                  .add_eventhandler('up', 'database',)
+                  .add_eventhandler('up', 'search',)
                   .add_eventhandler('down', 'preferences')
                   .add_eventhandler('right', 'randommode'))
     FSM.add_state(State('randommode', 'Random Mode')
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
-                      LM.marquee_start('Random '+mpdstatus.random(),
+                      LM.marquee_start('Random '+modestatus.random(),
                                        [left,updown,ok,'-toggles']),])
                   .add_eventhandler('return', 'modemenus')
                   .add_eventhandler('left', 'modemenus')
                   .add_eventhandler('up', 'singlemode')
                   .add_eventhandler('down', 'consumemode')
                   .add_eventhandler('select', 'randommode', [
-                      lambda ev, prev, nxt: mpdstatus.random(True),
+                      lambda ev, prev, nxt: modestatus.random(True),
                       ]))
     FSM.add_state(State('consumemode', 'Consume Mode')
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
-                      LM.marquee_start('Consume '+mpdstatus.consume(),
+                      LM.marquee_start('Consume '+modestatus.consume(),
                                        [left,updown,ok,'-toggles']),])
                   .add_eventhandler('return', 'modemenus')
                   .add_eventhandler('left', 'modemenus')
                   .add_eventhandler('up', 'randommode')
                   .add_eventhandler('down', 'repeatmode')
                   .add_eventhandler('select', 'consumemode', [
-                      lambda ev, prev, nxt: mpdstatus.consume(True),
+                      lambda ev, prev, nxt: modestatus.consume(True),
                       ]))
     FSM.add_state(State('repeatmode', 'Repeat Mode')
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
-                      LM.marquee_start('Repeat '+mpdstatus.repeat(),
+                      LM.marquee_start('Repeat '+modestatus.repeat(),
                                        [left,updown,ok,'-toggles']),])
                   .add_eventhandler('return', 'modemenus')
                   .add_eventhandler('left', 'modemenus')
                   .add_eventhandler('up', 'consumemode')
                   .add_eventhandler('down', 'singlemode')
                   .add_eventhandler('select', 'repeatmode', [
-                      lambda ev, prev, nxt: mpdstatus.repeat(True),
+                      lambda ev, prev, nxt: modestatus.repeat(True),
                       ]))
     FSM.add_state(State('singlemode', 'Single Mode')
                   .add_enterhandlers([
                       lambda ev, prev, nxt:
-                      LM.marquee_start('Single '+mpdstatus.single(),
+                      LM.marquee_start('Single '+modestatus.single(),
                                        [left,updown,ok,'-toggles']),])
                   .add_eventhandler('return', 'modemenus')
                   .add_eventhandler('left', 'modemenus')
                   .add_eventhandler('up', 'repeatmode')
                   .add_eventhandler('down', 'randommode')
                   .add_eventhandler('select', 'singlemode', [
-                      lambda ev, prev, nxt: mpdstatus.single(True),
+                      lambda ev, prev, nxt: modestatus.single(True),
                       ]))
     FSM.add_state(State('preferences', 'Preferences')
                   .add_enterhandlers([
@@ -1325,44 +1959,82 @@ def main():
                       MENUS.setchoice(),
                       ]))
     FSM.start('idle')
-    ## MPD object instance
-    CAD.lcd.blink_off()
-    CAD.lcd.cursor_off()
-    MPD.timeout = 15
-    connect_client(MPD,'MPD')
-    ping()
-    idlethread = Thread(target=idleloop)
-    idlethread.daemon = True
-    MPD2.timeout = 15
-    connect_client(MPD2,'MPD2')
-    idlethread.start()
-    infolooper()
+    STARTUP.phase('menus')
+    connecting.join()
+    STARTUP.phase('connect')
+    POOL.notify = show_if_free
+    POOL.reconnect.listeners.append(reconnect_now)
+    update_library()
+    if RUNTIME:
+        RUNTIME.add_periodic('pinger', check_connections, ping_delay)
+        RUNTIME.add_periodic('infoloop', show_info, info_interval)
+        RUNTIME.add_task('idleloop', async_idleloop)
+        RUNTIME.add_task('weather', weather.run_async, RUNTIME.loop)
+        RUNTIME.add_task('display', DISPLAY.run)
+    else:
+        ping()
+        idlethread = Thread(target=idleloop)
+        idlethread.daemon = True
+        idlethread.start()
+        weather.start()
+        infolooper()
     
     listener = pifacecad.IREventListener(prog="mpdremote")
-    listener.register('volumeup', lambda ev: mpdstatus.volume(ev.ir_code))
-    listener.register('volumedown', lambda ev: mpdstatus.volume(ev.ir_code))
-    listener.register('advance', lambda ev: mpdstatus.time(ev.ir_code))
-    listener.register('replay', lambda ev: mpdstatus.time(ev.ir_code))
-    listener.register('next', current_pl)
-    listener.register('prev', current_pl)
-    listener.register('disp', current_pl)
-    listener.register('power', power_off)
-    listener.register('play', play)
-    listener.register('pause', pause)
-    listener.register('stop', stop)
-    listener.register('snooze', snooze)
-    listener.register('menu', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('return', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('left', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('right', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('up', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('down', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('select', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('1key', lambda ev: FSM.execute(ev.ir_code))
-    listener.register('2key', lambda ev: FSM.execute(ev.ir_code))
+    def volume_event(ev, count=1):
+        with MPD:
+            mpdstatus.volume(ev.ir_code, count)
+    def seek_event(ev, count=1):
+        with MPD:
+            mpdstatus.time(ev.ir_code, count)
+    # the handlers wait on the mpd connections and the display lock, so
+    # they run on the dispatcher thread under the async runtime too
+    def register(ir_code, handler, steps=False, lane=DISPATCHER):
+        lane.register(ir_code, handler, steps)
+        listener.register(ir_code, lane.post)
+    # keys served by MPD have a lane of their own, so they never wait
+    # behind a menu listing on MPDB
+    register('volumeup', volume_event, steps=True, lane=TRANSPORT)
+    register('volumedown', volume_event, steps=True, lane=TRANSPORT)
+    register('advance', seek_event, steps=True, lane=TRANSPORT)
+    register('replay', seek_event, steps=True, lane=TRANSPORT)
+    register('next', current_pl, lane=TRANSPORT)
+    register('prev', current_pl, lane=TRANSPORT)
+    register('disp', current_pl, lane=TRANSPORT)
+    register('power', power_off, lane=TRANSPORT)
+    register('play', play, lane=TRANSPORT)
+    register('pause', pause, lane=TRANSPORT)
+    register('stop', stop, lane=TRANSPORT)
+    register('snooze', snooze, lane=TRANSPORT)
+    def menu_event(ev, count=1):
+        # menu actions share MPDB with the prefetchers
+        with MPDB:
+            # skip drawing a move that queued keys will move on from
+            queued = DISPATCHER.pending(FSM.current_state.handles)
+            FSM.execute(ev.ir_code, count, render=not queued)
+    register('menu', menu_event)
+    register('return', menu_event)
+    register('left', menu_event, steps=True)
+    register('right', menu_event)
+    register('up', menu_event, steps=True)
+    register('down', menu_event, steps=True)
+    register('select', menu_event)
+    for digit in DIGIT_KEYS:
+        register(digit, menu_event)
+    # 1 then 2 jumps to the next letter of a list, 2 then 1 to the previous
+    in_list = lambda: FSM.current_state.handles('nextgroup')
+    DISPATCHER.chord('1key', '2key', 'nextgroup', in_list)
+    DISPATCHER.chord('2key', '1key', 'prevgroup', in_list)
+    DISPATCHER.register('nextgroup', menu_event)
+    DISPATCHER.register('prevgroup', menu_event)
     listener.activate()
-    logging.debug('ir listener activated, waiting on barrier')
-    end_barrier.wait()  # wait unitl exit
+    STARTUP.phase('listener')
+    STARTUP.report()
+    if RUNTIME:
+        logging.debug('ir listener activated, running event loop')
+        RUNTIME.run() # until power_off
+    else:
+        logging.debug('ir listener activated, waiting on barrier')
+        end_barrier.wait()  # wait unitl exit
     logging.debug('deactivating listener')
     listener.deactivate()
     CAD.lcd.backlight_off()
@@ -5,13 +5,14 @@ Manages the pifacecad 16x2 LCD display.
 Provides a marquee scroll to allow up to 2x40 character banners to display.
 Provides mutex based locking to prevent display corruption by multiple threads.
 Manages backlight timing.
+Keeps a shadow copy of the 2x40 display RAM and only sends the changed cells.
 """
 
 import time
 import logging
-import threading
-from threading import Lock, Thread, Barrier
+from threading import Lock
 import pifacecad
+from scheduler import SCHEDULER
 from pifacecad.lcd import LCD_WIDTH, LCD_MAX_LINES, LCD_RAM_WIDTH
 
 LCD_LINE_WIDTH = int(LCD_RAM_WIDTH / LCD_MAX_LINES)
@@ -19,50 +20,74 @@ LCD_LINE_WIDTH = int(LCD_RAM_WIDTH / LCD_MAX_LINES)
 logger = logging.getLogger('marquee')
 
 class Marquee:
-    def __init__(self, pifacecad_lcd):
+    def __init__(self, pifacecad_lcd, scheduler=SCHEDULER):
         self._dlock = Lock() # internal lock for the lcd display
         self.display = pifacecad_lcd
+        self.scheduler = scheduler
         self.marquee_cnt = 0
         self.marquee_timer = None
-        self.backlight_timers = []
+        self.backlight_call = None # the one scheduled backlightoff()
+        self.backlight_deadline = None # monotonic time the backlight goes off
+        self.backlight_lit = False
         self.backlight_duration = 30.0 # seconds
+        self.backlight_ons = 0 # backlight on transitions
+        self.backlight_offs = 0 # backlight off transitions
         self.marquee_initial_shift_delay = 2.0 # seconds
         self.marquee_shift_delay = 1.25 # seconds
+        self.frame = None # shadow display RAM, None until first draw
+        self.shifted = 0 # display shifts since the last home
+        self.cell_writes = 0 # cells sent to the lcd
+        self.frames = 0 # frames drawn
     
     def backlightoff(self):
         logger.debug('Calling backlightoff()')
-        self.backlight_timers.pop(0)
-        logger.debug('backlight pop')
-        if not self.backlight_timers:
-            self._dlock.acquire()
-            self.display.backlight_off()
-            self._dlock.release()
-            logger.debug('backlight off')
+        self._dlock.acquire()
+        remaining = (self.backlight_deadline or 0.0) - time.monotonic()
+        if remaining > 0.01: # activity since this call was scheduled
+            self.backlight_call = self.scheduler.call_later(remaining,
+                                                            self.backlightoff)
+            logger.debug('backlight extended '+str(remaining)+' secs')
+        else:
+            self.backlight_call = None
+            self.backlight_deadline = None
+            if self.backlight_lit and self.backlight_duration > -0.9:
+                self.display.backlight_off()
+                self.backlight_lit = False
+                self.backlight_offs += 1
+                logger.debug('backlight off')
+        self._dlock.release()
     
     def cancel_timers(self):
         logger.debug('Calling cancel_timers()')
         if self.marquee_timer:
 ##            print('canceling marquee timer')
             self.marquee_timer.cancel()
-        while self.backlight_timers:
-            logger.debug('canceling backlight timers')
-            self.backlight_timers.pop(0).cancel()
+        if self.backlight_call:
+            logger.debug('canceling backlight timer')
+            self.backlight_call.cancel()
+            self.backlight_call = None
     
     def backlight_timer(self):
         logger.debug('Calling backlight_timer()')
         if self.backlight_duration > 0.1:
-            if len(self.backlight_timers) <= 0:
-                self._dlock.acquire()
+            self._dlock.acquire()
+            # activity only moves the deadline, one call turns the light off
+            self.backlight_deadline = time.monotonic() + self.backlight_duration
+            if not self.backlight_lit:
                 self.display.backlight_on()
-                self._dlock.release()
+                self.backlight_lit = True
+                self.backlight_ons += 1
                 logger.debug('backlight on')
-            self.backlight_timers.append(threading.Timer(self.backlight_duration,
-                                                         self.backlightoff))
-            self.backlight_timers[-1].start()
-            logger.debug('backlight push')
+            if self.backlight_call is None:
+                self.backlight_call = self.scheduler.call_later(
+                    self.backlight_duration, self.backlightoff)
+            self._dlock.release()
         elif self.backlight_duration < -0.9:
             self._dlock.acquire()
-            self.display.backlight_on()
+            if not self.backlight_lit:
+                self.display.backlight_on()
+                self.backlight_lit = True
+                self.backlight_ons += 1
             self._dlock.release()
     
     def marquee_shift(self): 
@@ -71,11 +96,11 @@ class Marquee:
         self.marquee_cnt -= 1
         self._dlock.acquire()
         self.display.move_left()
+        self.shifted += 1
         self._dlock.release()
         if self.marquee_cnt > 0:
-            self.marquee_timer = threading.Timer(self.marquee_shift_delay,
-                                                 self.marquee_shift)
-            self.marquee_timer.start()
+            self.marquee_timer = self.scheduler.call_later(
+                self.marquee_shift_delay, self.marquee_shift)
     
     def _marqlen(self, items):
         itemslen = 0
@@ -93,20 +118,52 @@ class Marquee:
                 break # no more room on the LCD line
         return itemslen, truncateditems
     
-    def _marq_write(self, items):
-##        Assumes _dlock is acquired before calling
-        logger.debug('Calling _marq_write('+str(items)+')')
+    def _cells(self, items):
+        cells = []
         for item in items:
             if type(item) is int:
-                self.display.write_custom_bitmap(item)
+                cells.append(item) # custom bitmap
             elif type(item) is str:
-                self.display.write(item)
+                cells.extend(item)
+        cells = cells[0:LCD_LINE_WIDTH]
+        cells.extend([' '] * (LCD_LINE_WIDTH - len(cells)))
+        return cells
+    
+    def _marq_write(self, frame):
+##        Assumes _dlock is acquired before calling
+        logger.debug('Calling _marq_write('+str(frame)+')')
+        if self.frame is None:
+            self.display.clear()
+            self.frame = [[' '] * LCD_LINE_WIDTH for row in frame]
+            self.shifted = 0
+        if self.shifted:
+            self.display.home() # undo the marquee shifts, ram is unchanged
+            self.shifted = 0
+        for row in range(len(frame)):
+            old = self.frame[row]
+            new = frame[row]
+            col = 0
+            while col < LCD_LINE_WIDTH:
+                if old[col] == new[col]:
+                    col += 1
+                    continue
+                self.display.set_cursor(col, row)
+                while col < LCD_LINE_WIDTH and old[col] != new[col]:
+                    if type(new[col]) is int:
+                        self.display.write_custom_bitmap(new[col])
+                        col += 1
+                    else:
+                        start = col
+                        while (col < LCD_LINE_WIDTH and old[col] != new[col]
+                               and type(new[col]) is str):
+                            col += 1
+                        self.display.write(''.join(new[start:col]))
+                    self.cell_writes += 1
+            self.frame[row] = new
+        self.frames += 1
     
     def marquee_start(self, text, text2=None):
         logger.debug('Calling marquee_start('+str(text)+','+str(text2)+')')
-        if self.marquee_timer:   # cancel any marquee underway
-            self.marquee_timer.cancel()
-            self.marquee_timer = None
         if type(text) is str:
             text = [text]
         if type(text2) is str:
@@ -116,21 +173,24 @@ class Marquee:
         dsp_len2 = 0
         if text2:
             (dsp_len2,text2) = self._marqlen(text2)  # trim line2 to display width
+        frame = [self._cells(text), self._cells(text2 if text2 else [])]
+        if frame == self.frame and (self.marquee_timer or not self.shifted):
+            logger.debug('marquee unchanged')  # leave any marquee underway
+            self.backlight_timer()
+            return
+        if self.marquee_timer:   # cancel any marquee underway
+            self.marquee_timer.cancel()
+            self.marquee_timer = None
         self.marquee_cnt = max(max(dsp_len - LCD_WIDTH, 0),
                                max(dsp_len2 - LCD_WIDTH, 0))
         self.backlight_timer()
         self._dlock.acquire()
-        self.display.clear()
-        self._marq_write(text)
-        if text2:
-            self.display.write("\n")
-            self._marq_write(text2)
+        self._marq_write(frame)
         self._dlock.release()
         if self.marquee_cnt > 0:
             #print('starting marquee for ' + str(self.marquee_cnt) + ' shifts')
-            self.marquee_timer = threading.Timer(self.marquee_initial_shift_delay,
-                                                 self.marquee_shift)
-            self.marquee_timer.start()
+            self.marquee_timer = self.scheduler.call_later(
+                self.marquee_initial_shift_delay, self.marquee_shift)
         #else:
             #print('no marquee started')
     
@@ -139,8 +199,8 @@ class Marquee:
         self.marquee_start(lines[0], lines[1])
 
 class LockableMarquee(Marquee):
-    def __init__(self, pifacecad_lcd):
-        super(LockableMarquee, self).__init__(pifacecad_lcd)
+    def __init__(self, pifacecad_lcd, scheduler=SCHEDULER):
+        super(LockableMarquee, self).__init__(pifacecad_lcd, scheduler)
         self._lock = Lock()
     def acquire(self,blocking=True, timeout=-1):
         #print('acquiring LCD lock')
@@ -0,0 +1,111 @@
+#! /usr/bin/python3
+
+"""
+The preference menu schema.
+The [preferencemenu] section of mpdremoterc declares the menus. It is parsed
+and validated once, at startup, into PreferenceItems; nothing in it is ever
+evaluated as code. Choices are a literal list of quoted strings, or the name
+of a registered provider that computes them when the menu is opened.
+on_value_change names a registered hook.
+"""
+
+import ast
+import logging
+
+logger = logging.getLogger('preferences')
+
+class PreferenceSchemaError(ValueError):
+    pass
+
+def _name(text):
+##  'reconnect_clients' or 'reconnect_clients()', None if not a plain name
+    text = text.strip()
+    if text.endswith('()'):
+        text = text[:-2]
+    return text if text.isidentifier() else None
+
+def _strings(text, what):
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError) as err:
+        raise PreferenceSchemaError(what+': '+str(err))
+    if type(value) is str:
+        value = (value,)
+    if type(value) not in (tuple, list) or not all(type(v) is str for v in value):
+        raise PreferenceSchemaError(what+' must be a list of quoted strings')
+    return tuple(value)
+
+class PreferenceItem:
+    def __init__(self, label, key, choices=(), provider=None, on_change=None,
+                 on_change_name=None):
+        self.label = label
+        self.key = key                  # option in [preferences]
+        self.static_choices = choices
+        self.provider = provider        # computes the choices, if dynamic
+        self.on_change = on_change      # called after the value changed
+        self.on_change_name = on_change_name
+
+    def choices(self):
+        if self.provider:
+            return tuple(self.provider())
+        return self.static_choices
+
+class PreferenceSchema:
+    def __init__(self):
+        self.providers = {} # name -> function returning the choices
+        self.hooks = {}     # name -> function called on a value change
+        self.items = []
+
+    def provider(self, name, function):
+        self.providers[name] = function
+        return self
+
+    def hook(self, name, function):
+        self.hooks[name] = function
+        return self
+
+    def parse(self, section):
+        """Parses a [preferencemenu] section. Invalid menus are logged and
+        left out, so one typo does not cost the whole preference menu.
+        """
+        items = []
+        try:
+            labels = _strings(section.get('menu_choices', '()'), 'menu_choices')
+        except PreferenceSchemaError as err:
+            logger.error(str(err))
+            labels = ()
+        for label in labels:
+            try:
+                items.append(self.item(section, label))
+            except PreferenceSchemaError as err:
+                logger.error('preference menu '+label+': '+str(err))
+        self.items = items
+        logger.debug('preference menus: '+', '.join(i.label for i in items))
+        return self
+
+    def item(self, section, label):
+        menu = label.split()[0]
+        key = section.get(menu+'_value')
+        if not key:
+            raise PreferenceSchemaError(menu+'_value is not set')
+        text = section.get(menu+'_choices')
+        if text is None:
+            raise PreferenceSchemaError(menu+'_choices is not set')
+        choices = ()
+        provider = _name(text)
+        if provider:
+            if provider not in self.providers:
+                raise PreferenceSchemaError('no choice provider '+provider)
+            provider = self.providers[provider]
+        else:
+            choices = _strings(text, menu+'_choices')
+        on_change = None
+        hook = section.get(menu+'_on_value_change', 'pass').strip()
+        if hook == 'pass':
+            hook = None
+        else:
+            hook = _name(hook)
+            if hook not in self.hooks:
+                raise PreferenceSchemaError('no on_value_change hook '+str(hook))
+            on_change = self.hooks[hook]
+        return PreferenceItem(label, key, choices, provider, on_change, hook)
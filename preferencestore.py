@@ -0,0 +1,93 @@
+#! /usr/bin/python3
+
+"""
+Saves the dynamic preferences.
+Changes are batched: the file is written in the background once no change
+has been made for delay seconds, and only if its contents would differ.
+The new file is written beside the old one, synced and renamed over it, so
+a crash or power cut leaves either the old or the new preferences, never a
+truncated file.
+"""
+
+import os
+import logging
+from threading import Lock
+from scheduler import Debouncer
+
+logger = logging.getLogger('preferences')
+
+SAVE_DELAY = 5.0 # seconds without changes before the preferences are written
+
+class PreferenceStore:
+    def __init__(self, config, path, section='preferences', delay=SAVE_DELAY):
+        self._lock = Lock()
+        self.config = config
+        self.path = os.path.expanduser(path)
+        self.section = section
+        self.writer = Debouncer(delay, 'prefsave') # latest change wins
+        self.saved = self._read() # contents on disk, to skip unchanged writes
+        self.pending = False # a change is waiting to be written
+        self.writes = 0  # files written
+
+    def _read(self):
+        try:
+            with open(self.path) as fd:
+                return fd.read()
+        except (IOError, OSError):
+            return None
+
+    def render(self):
+        lines = ['['+self.section+']\n']
+        for (key, value) in list(self.config[self.section].items()):
+            value = value.replace('%', '%%') # escape % characters
+            lines.append('    '+key+' = '+value+'\n')
+        return ''.join(lines)
+
+    def changed(self):
+        self.pending = True
+        self.writer.post(self.flush)
+
+    def flush(self):
+        """Writes the preferences now if they changed. Returns True if the
+        file was written.
+        """
+        with self._lock:
+            self.pending = False
+            text = self.render()
+            if text == self.saved:
+                logger.debug('preferences unchanged, not saved')
+                return False
+            temp = self.path+'.tmp'
+            try:
+                with open(temp, 'w') as fd:
+                    fd.write(text)
+                    fd.flush()
+                    os.fsync(fd.fileno())
+                os.replace(temp, self.path)
+                self._sync_directory()
+            except (IOError, OSError) as err:
+                logger.warning('cannot save preference change to '+self.path+
+                               ': '+str(err))
+                return False
+            self.saved = text
+            self.writes += 1
+            logger.debug('preferences saved to '+self.path)
+            return True
+
+    def _sync_directory(self):
+        # makes the rename itself durable
+        try:
+            fd = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Writes a pending change now, for shutdown."""
+        self.writer.cancel()
+        return self.flush() if self.pending else False
@@ -0,0 +1,136 @@
+#! /usr/bin/python3
+
+"""
+Indexes the play queue titles for jumping to a song.
+The T9 digits of every title are kept by queue position, and a sorted copy
+finds the positions whose title starts with the typed digits by bisection.
+The index follows the playlist version from status: it is built once with a
+streamed playlistinfo on a thread of its own, after which only the songs that plchanges reports
+since the indexed version are read again. The sorted copy is rebuilt on the
+first search after a change.
+"""
+
+import logging
+from bisect import bisect_left
+from threading import Lock
+from mpd import (CommandError, ConnectionError)
+from socket import error as SocketError
+from socket import timeout as SocketTimeout
+from scheduler import Debouncer
+from libraryindex import t9
+
+logger = logging.getLogger('queueindex')
+
+SYNC_DELAY = 1.0  # seconds, playlist events within this time sync once
+MAX_MATCHES = 100 # positions returned by a search
+
+class QueueIndex:
+    def __init__(self, delay=SYNC_DELAY):
+        self._lock = Lock()
+        self.version = None # indexed playlist version, None if not built
+        self.keys = []      # queue position -> T9 digits of the title
+        self._sorted = None # (sorted keys, their positions), None after a change
+        self.syncer = Debouncer(delay, 'queueindex')
+        self.builder = Debouncer(0.0, 'queuebuild') # not delayed, a menu waits
+        self.building = False
+        self.builds = 0     # full playlistinfo reads
+        self.deltas = 0     # plchanges reads
+
+    def __len__(self):
+        return len(self.keys)
+
+    def ready(self):
+        return self.version is not None
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+            self.keys = []
+            self._sorted = None
+
+    def sync(self, mpd_client, status=None):
+##      Assumes the mpd_client lock is acquired before calling
+        if status is None:
+            status = mpd_client.status()
+        if 'playlist' not in status or 'playlistlength' not in status:
+            self.invalidate()
+            return self
+        version = int(status['playlist'])
+        length = int(status['playlistlength'])
+        with self._lock:
+            oldversion = self.version
+            if oldversion == version:
+                return self
+            keys = self.keys[:length] if oldversion is not None else []
+        keys.extend([''] * (length - len(keys)))
+        iterate = getattr(mpd_client, 'iterate', False)
+        mpd_client.iterate = True # streamed, a long queue is not held twice
+        try:
+            if oldversion is None:
+                songs = mpd_client.playlistinfo()
+            else:
+                songs = mpd_client.plchanges(oldversion)
+            for song in songs:
+                pos = int(song['pos'])
+                if pos < length:
+                    title = song.get('title', song.get('name', song.get('file', '')))
+                    if type(title) is list: # repeated tags
+                        title = title[0]
+                    keys[pos] = t9(title)
+        finally:
+            mpd_client.iterate = iterate
+        with self._lock:
+            if self.version != oldversion:
+                logger.debug('play queue indexed by another sync, discarding')
+                return self
+            if oldversion is None:
+                self.builds += 1
+            else:
+                self.deltas += 1
+            logger.debug('play queue index version '+str(oldversion)+' -> '+
+                         str(version)+', '+str(length)+' songs')
+            self.keys = keys
+            self.version = version
+            self._sorted = None
+        return self
+
+    def start_sync(self, mpd_client):
+        """Follows a play queue change in the background, once the index
+        has been built.
+        """
+        if self.version is not None:
+            self.syncer.post(self._sync, mpd_client)
+
+    def start_build(self, mpd_client):
+        """Builds the index, or brings it up to date, in the background."""
+        self.building = True
+        self.builder.post(self._build, mpd_client)
+
+    def _build(self, mpd_client):
+        try:
+            self._sync(mpd_client)
+        finally:
+            self.building = self.builder.pending()
+
+    def _sync(self, mpd_client):
+        with mpd_client:
+            try:
+                self.sync(mpd_client)
+            except (CommandError, ConnectionError, SocketError, SocketTimeout,
+                    IOError) as err:
+                logger.debug('play queue index sync failed: '+str(err))
+                self.invalidate()
+
+    def search(self, digits, limit=MAX_MATCHES):
+        """Queue positions whose title starts with digits, in title order."""
+        if not digits:
+            return []
+        with self._lock:
+            if self._sorted is None:
+                keys = self.keys
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                self._sorted = ([keys[pos] for pos in order], order)
+            (keys, order) = self._sorted
+        start = bisect_left(keys, digits)
+        end = bisect_left(keys, digits+':', start) # ':' sorts right after '9'
+        return order[start:min(end, start + limit)]
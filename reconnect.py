@@ -0,0 +1,106 @@
+#! /usr/bin/python3
+
+"""
+When to retry a lost mpd connection.
+The first retry after a failure is immediate, which is all a brief network
+blip needs. Further retries back off exponentially up to a cap, with random
+jitter so several clients do not retry in step. A success resets the backoff,
+and wake() cuts a wait short, e.g. when avahi reports the server is back.
+"""
+
+import time
+import random
+import asyncio
+import logging
+from threading import Condition
+
+logger = logging.getLogger('reconnect')
+
+BASE = 0.5    # seconds, wait after the immediate retry has failed
+CAP = 60.0    # seconds, longest wait between retries
+JITTER = 0.5  # fraction of a wait that is randomized
+
+class ReconnectStrategy:
+    def __init__(self, base=BASE, cap=CAP, jitter=JITTER):
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self._cond = Condition()
+        self.failures = 0       # failed attempts since the last success
+        self.retry_at = 0.0     # monotonic time the next attempt is allowed
+        self.down_since = None  # monotonic time of the first failure
+        self.listeners = []     # called on wake(), from the waking thread
+        self._wakeups = 0
+        self.recoveries = 0     # outages recovered from
+        self.recovery_max = 0.0 # longest outage recovered from, seconds
+
+    def backoff(self, failures):
+        if failures == 0:
+            return 0.0
+        delay = min(self.cap, self.base * 2 ** (failures - 1))
+        return random.uniform(delay * (1.0 - self.jitter), delay)
+
+    def failed(self):
+        """Records a failed attempt, returns seconds until the next one."""
+        with self._cond:
+            now = time.monotonic()
+            if self.down_since is None:
+                self.down_since = now
+            delay = self.backoff(self.failures)
+            self.failures += 1
+            self.retry_at = now + delay
+        logger.debug('attempt '+str(self.failures)+' failed, retry in '+
+                     '{:.1f}'.format(delay)+' secs')
+        return delay
+
+    def succeeded(self):
+        with self._cond:
+            if self.down_since is not None:
+                outage = time.monotonic() - self.down_since
+                self.recoveries += 1
+                self.recovery_max = max(self.recovery_max, outage)
+                logger.info('reconnected after '+'{:.1f}'.format(outage)+' secs')
+            self.reset()
+
+    def reset(self):
+        with self._cond:
+            self.failures = 0
+            self.retry_at = 0.0
+            self.down_since = None
+
+    def remaining(self):
+        with self._cond:
+            return max(0.0, self.retry_at - time.monotonic())
+
+    def wake(self):
+        """Allows an immediate attempt and ends all waits."""
+        with self._cond:
+            self.failures = 0
+            self.retry_at = 0.0
+            self._wakeups += 1
+            self._cond.notify_all()
+        for listener in list(self.listeners):
+            listener()
+
+    def wait(self):
+        """Blocks until the next attempt is allowed or wake() is called."""
+        with self._cond:
+            wakeups = self._wakeups
+            while wakeups == self._wakeups:
+                wait = self.retry_at - time.monotonic()
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+
+    async def wait_async(self):
+        """wait() for an asyncio task."""
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(woken.set)
+        self.listeners.append(listener)
+        try:
+            await asyncio.wait_for(woken.wait(), self.remaining())
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.listeners.remove(listener)
@@ -0,0 +1,139 @@
+#! /usr/bin/python3
+
+"""
+Runs delayed calls on one shared thread.
+threading.Timer starts a new thread for every call; the marquee scroll, the
+backlight, the mpd pinger, the info loop and snooze all schedule through here
+instead, so the thread count stays constant however fast events arrive.
+Callbacks share the thread, so they must not block on locks held by others.
+Debouncer runs only the latest of a burst of requests, on a thread of its own
+that may block.
+"""
+
+import time
+import heapq
+import logging
+import itertools
+from threading import Condition, Thread
+
+logger = logging.getLogger('scheduler')
+
+class ScheduledCall:
+    def __init__(self, when, function, args):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._cond = Condition()
+        self._heap = []
+        self._seq = itertools.count() # keeps equal times in call order
+        self._thread = None
+        self.calls = 0          # callbacks run
+        self.late_total = 0.0   # seconds callbacks ran after their due time
+        self.late_max = 0.0
+        self.run_max = 0.0      # longest callback, seconds
+
+    def call_later(self, delay, function, *args):
+        call = ScheduledCall(time.monotonic() + delay, function, args)
+        with self._cond:
+            heapq.heappush(self._heap, (call.when, next(self._seq), call))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return call
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for (when, seq, call) in self._heap
+                       if not call.cancelled)
+
+    def stats(self):
+        return {'calls': self.calls,
+                'pending': self.pending(),
+                'late_mean': self.late_total / self.calls if self.calls else 0.0,
+                'late_max': self.late_max,
+                'run_max': self.run_max,
+                }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][2].cancelled:
+                    if self._heap:
+                        heapq.heappop(self._heap) # drop cancelled calls
+                    else:
+                        self._cond.wait()
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue # an earlier call may have been added
+                (when, seq, call) = heapq.heappop(self._heap)
+            if call.cancelled: # canceled after it was taken off the heap
+                continue
+            started = time.monotonic()
+            late = started - when
+            try:
+                call.function(*call.args)
+            except Exception:
+                logger.exception('scheduled call '+str(call.function)+' failed')
+            self.calls += 1
+            self.late_total += late
+            self.late_max = max(self.late_max, late)
+            self.run_max = max(self.run_max, time.monotonic() - started)
+
+class Debouncer:
+    """Runs the newest request on one background thread, once the requests
+    have stopped changing for delay seconds.
+    """
+    def __init__(self, delay, name='debouncer'):
+        self.delay = delay
+        self.name = name
+        self._cond = Condition()
+        self._request = None
+        self._posted = 0.0
+        self._thread = None
+
+    def post(self, function, *args):
+        with self._cond:
+            self._request = (function, args) # latest wins
+            self._posted = time.monotonic()
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self._request = None
+
+    def pending(self):
+        with self._cond:
+            return self._request is not None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._request is None:
+                    self._cond.wait()
+                wait = self._posted + self.delay - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                (function, args) = self._request
+                self._request = None
+            try:
+                function(*args)
+            except Exception as err:
+                logger.debug(self.name+' '+str(args)+' failed: '+str(err))
+
+SCHEDULER = Scheduler() # shared by the whole program
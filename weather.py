@@ -13,15 +13,21 @@ if not PY3:
     print("Weather only works with `python3`.")
     sys.exit(1)
 
+import asyncio
+import logging
 import urllib.request
 import xml.etree.ElementTree
-from time import sleep
-from threading import Barrier
+from time import sleep, monotonic
+from threading import Barrier, Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
 import pifacecommon
 import pifacecad
 
+logger = logging.getLogger('weather')
 
 UPDATE_INTERVAL = 60  # seconds
+FETCH_TIMEOUT = 10  # seconds
+MAX_AGE = 600  # seconds a fetched condition is fresh
 
 WEATHER_STATIONS = [
     {"location": "Bellingham", "id": "KWABELLI80"},
@@ -38,15 +44,24 @@ TEMP_SYMBOL_INDEX, WIND_SYMBOL_INDEX = 6, 7
 
 
 class WeatherStation(object):
-    def __init__(self, location, weather_id):
+    def __init__(self, location, weather_id, url=None):
         self.location = location
         self.weather_id = weather_id
+        self.url = url if url else get_current_condition_url(weather_id)
         self._xmltree = None
+        self.fetched = None  # monotonic time of the last good fetch
 
-    def generate_xmltree(self):
-        url = get_current_condition_url(self.weather_id)
-        data = urllib.request.urlopen(url)
+    def generate_xmltree(self, timeout=FETCH_TIMEOUT):
+        data = urllib.request.urlopen(self.url, timeout=timeout)
         self._xmltree = xml.etree.ElementTree.XML(data.read())
+        self.fetched = monotonic()
+
+    @property
+    def age(self):
+        """Seconds since the last good fetch, None if never fetched."""
+        if self.fetched is None:
+            return None
+        return monotonic() - self.fetched
 
     @property
     def xmltree(self):
@@ -73,6 +88,94 @@ class WeatherStation(object):
         return self.xmltree.findall("wind_mph")[0].text
 
 
+class WeatherFetcher(object):
+    """Keeps the current conditions of a list of stations in the background.
+    All stations are fetched concurrently every max_age seconds. Readers only
+    see cached conditions: a stale station is served as is while a refresh is
+    started (stale-while-revalidate), so a slow endpoint never blocks them.
+    """
+    def __init__(self, stations, max_age=MAX_AGE, timeout=FETCH_TIMEOUT):
+        self.stations = stations
+        self.max_age = max_age
+        self.timeout = timeout
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._thread = None
+        self.on_revalidate = None  # called by revalidate, for the async runtime
+        self.errors = {}  # weather_id -> last fetch error
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.stations:
+                self._stop.clear()
+                self._thread = Thread(target=self._run, name='weather')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def revalidate(self):
+        self._wakeup.set()
+        if self.on_revalidate:
+            self.on_revalidate()
+
+    def _fetch(self, station):
+        try:
+            station.generate_xmltree(self.timeout)
+            self.errors.pop(station.weather_id, None)
+            logger.debug(station.location+': fetched')
+        except Exception as err:
+            self.errors[station.weather_id] = err
+            logger.error(station.location+': '+station.weather_id+': '+str(err))
+
+    def fetch_all(self):
+        with ThreadPoolExecutor(max_workers=len(self.stations)) as pool:
+            list(pool.map(self._fetch, self.stations))
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = monotonic()
+            self.fetch_all()
+            self._wakeup.wait(self.max_age)
+            self._wakeup.clear()
+            # do not hammer a failing endpoint on every stale read
+            self._stop.wait(max(0.0, self.timeout - (monotonic() - started)))
+        with self._lock:
+            self._thread = None
+
+    async def run_async(self, loop):
+        """The background refresh as an asyncio task. The blocking fetches
+        run in the loop's default executor.
+        """
+        wakeup = asyncio.Event()
+        self.on_revalidate = lambda: loop.call_soon_threadsafe(wakeup.set)
+        try:
+            while self.stations:
+                started = monotonic()
+                await loop.run_in_executor(None, self.fetch_all)
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.max_age)
+                except asyncio.TimeoutError:
+                    pass
+                # do not hammer a failing endpoint on every stale read
+                await asyncio.sleep(max(0.0, self.timeout - (monotonic() - started)))
+        finally:
+            self.on_revalidate = None
+
+    def cached(self, station):
+        """Returns the station if it has conditions to show, else None.
+        Starts a background refresh when the conditions are stale.
+        """
+        age = station.age
+        if age is None or age > self.max_age:
+            self.revalidate()
+        return station if age is not None else None
+
+
 class WeatherDisplay(object):
     def __init__(self, cad, stations, station_index=0):
         self.stations = stations